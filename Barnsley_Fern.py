@@ -1,51 +1,185 @@
-"""
-@author: HuidobroMG
-
-We construct the Barnsley fern fractal and plot the final result.
-We use an iterated function system (IFS) with the appropriate affine transformations.
-Modifications of the fern (called mutations) are possible by changing the affine functions f_i.
-"""
-
-# Import the modules
-import random as rn
-import numpy as np
-import matplotlib.pyplot as plt
-
-# Affine transformations of the Barnsley fern
-f1 = np.array([0, 0, 0, 0.16, 0, 0])
-f2 = np.array([0.85, 0.04, -0.04, 0.85, 0, 1.6])
-f3 = np.array([0.2, -0.26, 0.23, 0.22, 0, 1.6])
-f4 = np.array([-0.15, 0.28, 0.26, 0.24, 0, 0.44])
-
-# Iteration function for each step
-def iterate(position, f):
-    """
-    Computes the next position in the Barnsley fern using the affine transformation f
-    """
-    new_position = np.dot(f[:-2].reshape(2, 2), position) + f[-2:]
-    return new_position
-
-# Number of iterations
-N = int(1e5)
-
-# Initialize the fern with a random initial position in the plane
-fern = np.zeros((N, 2))
-pos = np.array([0, 0])
-fern[0] = pos
-for i in range(1, N):
-    p = rn.random()
-    if p < 0.01:
-        pos = iterate(pos, f1)
-    elif p < 0.86:
-        pos = iterate(pos, f2)
-    elif p < 0.93:
-        pos = iterate(pos, f3)
-    else:
-        pos = iterate(pos, f4)
-
-    fern[i] = pos
-
-# Plot
-plt.plot(fern[:, 0], fern[:, 1], 'g,')
-plt.axis('off')
-plt.show()
+"""
+@author: HuidobroMG
+
+We construct the Barnsley fern fractal and plot the final result.
+We use an iterated function system (IFS) with the appropriate affine transformations.
+Modifications of the fern (called mutations) are possible by changing the affine functions f_i.
+Any other IFS may be rendered by giving its table of affine transformations to ifs_histogram,
+which distributes the work among several processes.
+"""
+
+# Import the modules
+import multiprocessing as mp
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Affine transformations of the Barnsley fern
+f1 = np.array([0, 0, 0, 0.16, 0, 0])
+f2 = np.array([0.85, 0.04, -0.04, 0.85, 0, 1.6])
+f3 = np.array([0.2, -0.26, 0.23, 0.22, 0, 1.6])
+f4 = np.array([-0.15, 0.28, 0.26, 0.24, 0, 0.44])
+
+# Chaos game with many independent walkers moving in lockstep
+def chaos_steps(maps, probs, n_walkers = 4096, burn_in = 20, rng = None):
+    """
+    Yields the positions of n_walkers independent walkers after each step of the chaos game.
+    Each row of maps holds the coefficients (a, b, c, d, e, f) of one affine transformation,
+    with the same layout as f1, ..., f4, and probs are the probabilities to choose each of them.
+    The first burn_in steps are discarded so that the walkers have reached the attractor.
+    """
+    rng = np.random.default_rng(rng)
+    maps = np.asarray(maps, dtype = float)
+    cumulative = np.cumsum(np.asarray(probs, dtype = float))
+    cumulative /= cumulative[-1]
+    a, b, c, d, e, f = maps.T
+
+    x = rng.random(n_walkers)
+    y = rng.random(n_walkers)
+    step = 0
+    while True:
+        k = np.searchsorted(cumulative, rng.random(n_walkers), side = 'right')
+        k = np.minimum(k, len(maps) - 1)
+        x, y = a[k]*x + b[k]*y + e[k], c[k]*x + d[k]*y + f[k]
+        step += 1
+        if step > burn_in:
+            yield np.column_stack((x, y))
+
+def chaos_game(maps, probs, N, n_walkers = 4096, burn_in = 20, rng = None):
+    """
+    Generates N points of the attractor of the IFS given by maps and probs
+    """
+    n_walkers = min(n_walkers, N)
+    points = np.zeros((N, 2))
+    steps = chaos_steps(maps, probs, n_walkers, burn_in, rng)
+    for i in range(0, N, n_walkers):
+        new_points = next(steps)
+        points[i:i+n_walkers] = new_points[:N-i]
+    return points
+
+# Bounding box (x_min, x_max, y_min, y_max) of the Barnsley fern
+FERN_BOUNDS = (-2.2, 2.7, 0, 10)
+
+# Density of points of the fractal in a fixed grid of pixels
+def density_histogram(maps, probs, N, bounds = FERN_BOUNDS, resolution = (500, 1000),
+                      chunk = 64, n_walkers = 4096, burn_in = 20, rng = None):
+    """
+    Bins N points of the attractor into a (height, width) grid of counts over bounds.
+    The points are generated and binned in chunks of chunk steps and then discarded,
+    so the memory used does not depend on N.
+    """
+    x_min, x_max, y_min, y_max = bounds
+    width, height = resolution
+    counts = np.zeros(width*height, dtype = np.int64)
+    steps = chaos_steps(maps, probs, n_walkers, burn_in, rng)
+    n_steps = -(-N//n_walkers)
+    for i in range(0, n_steps, chunk):
+        points = np.concatenate([next(steps) for j in range(min(chunk, n_steps - i))])
+        if i + chunk >= n_steps:
+            points = points[:N - i*n_walkers]
+        ix = ((points[:, 0] - x_min)*(width/(x_max - x_min))).astype(np.int64)
+        iy = ((points[:, 1] - y_min)*(height/(y_max - y_min))).astype(np.int64)
+        inside = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+        counts += np.bincount(iy[inside]*width + ix[inside], minlength = width*height)
+    return counts.reshape(height, width)
+
+def tone_map(counts, gamma = 2.2, log = True):
+    """
+    Converts the counts into an image with values between 0 and 1
+    using a logarithmic scale and a gamma correction
+    """
+    image = np.log1p(counts) if log else counts.astype(float)
+    if image.max() > 0:
+        image = image/image.max()
+    return image**(1/gamma)
+
+# Default probabilities of an IFS, proportional to the area scaling of each transformation
+def ifs_probabilities(maps, min_weight = 0.01):
+    """
+    Computes the probabilities of the affine transformations from the absolute values
+    of their determinants. Singular transformations (as f1) get a weight min_weight.
+    """
+    maps = np.asarray(maps, dtype = float)
+    weights = np.abs(maps[:, 0]*maps[:, 3] - maps[:, 1]*maps[:, 2])
+    weights = np.maximum(weights, min_weight)
+    return weights/np.sum(weights)
+
+def ifs_bounds(maps, probs, N = int(1e5), margin = 0.02, rng = None):
+    """
+    Estimates the bounding box of the attractor from a short chaos game
+    """
+    points = chaos_game(maps, probs, N, rng = rng)
+    x_min, y_min = np.min(points, axis = 0)
+    x_max, y_max = np.max(points, axis = 0)
+    dx = margin*(x_max - x_min) + 1e-12
+    dy = margin*(y_max - y_min) + 1e-12
+    return (x_min - dx, x_max + dx, y_min - dy, y_max + dy)
+
+def _histogram_job(args):
+    """
+    Computes the density histogram of one job of the process pool
+    """
+    maps, probs, N, bounds, resolution, seed = args
+    return density_histogram(maps, probs, N, bounds, resolution, rng = np.random.default_rng(seed))
+
+# Parallel chaos game of any IFS
+def ifs_histogram(maps, probs = None, N = int(1e8), bounds = None, resolution = (500, 1000),
+                  n_workers = None, seed = None):
+    """
+    Computes the density histogram of N points of the IFS given by the table maps,
+    splitting the chaos game among n_workers processes with independent random streams
+    and adding the histograms of every worker at the end.
+    """
+    maps = np.asarray(maps, dtype = float)
+    probs = ifs_probabilities(maps) if probs is None else np.asarray(probs, dtype = float)
+    n_workers = mp.cpu_count() if n_workers is None else n_workers
+    seeds = np.random.SeedSequence(seed).spawn(n_workers + 1)
+    if bounds is None:
+        bounds = ifs_bounds(maps, probs, rng = np.random.default_rng(seeds[-1]))
+
+    sizes = [N//n_workers + (1 if i < N % n_workers else 0) for i in range(n_workers)]
+    jobs = [(maps, probs, sizes[i], bounds, resolution, seeds[i]) for i in range(n_workers) if sizes[i] > 0]
+    with mp.Pool(n_workers) as pool:
+        counts = pool.map(_histogram_job, jobs)
+    return np.sum(counts, axis = 0), bounds
+
+def mutation_sweep(tables, N = int(1e7), resolution = (500, 1000), n_workers = None, seed = None):
+    """
+    Computes the density histograms of many IFS tables (mutations of the fern),
+    rendering one table in each job of the process pool.
+    Each element of tables is either the array of affine transformations
+    or a pair (maps, probs). Returns a list of (counts, bounds).
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(tables))
+    jobs = []
+    for i in range(len(tables)):
+        if isinstance(tables[i], tuple):
+            maps, probs = tables[i]
+        else:
+            maps, probs = tables[i], None
+        maps = np.asarray(maps, dtype = float)
+        probs = ifs_probabilities(maps) if probs is None else np.asarray(probs, dtype = float)
+        bounds = ifs_bounds(maps, probs, rng = np.random.default_rng(seeds[i]))
+        jobs.append((maps, probs, N, bounds, resolution, seeds[i]))
+    with mp.Pool(n_workers) as pool:
+        counts = pool.map(_histogram_job, jobs)
+    return [(counts[i], jobs[i][3]) for i in range(len(jobs))]
+
+if __name__ == '__main__':
+    # Affine transformations and probabilities of each one
+    maps = np.array([f1, f2, f3, f4])
+    probs = np.array([0.01, 0.85, 0.07, 0.07])
+
+    # Number of iterations
+    N = int(1e7)
+
+    # Bin the points into a grid of pixels (STREAM = 1) or keep all of them (STREAM = 0)
+    STREAM = 1
+    if STREAM == 1:
+        counts, bounds = ifs_histogram(maps, probs, N, FERN_BOUNDS)
+        plt.imshow(tone_map(counts), cmap = 'Greens', origin = 'lower',
+                   extent = FERN_BOUNDS, interpolation = 'nearest')
+    else:
+        fern = chaos_game(maps, probs, N)
+        plt.plot(fern[:, 0], fern[:, 1], 'g,')
+    plt.axis('off')
+    plt.show()
@@ -1,79 +1,258 @@
-"""
-@author: HuidobroMG
-
-We simulate the Roulette game of the casino and plot the results.
-In the first part of the code, we simulate the results when the bet is just red or black.
-As a result, we see a decrease in the large number of bets limit since the 0 is not considered either red or black.
-The slope of the straight line is precisely 1/37, the probability of 0 among the 37 possible numbers.
-
-In the second part, we simulate the results when we bet on 1 or 2 dozens.
-Although it seems that 2 dozens doubles the probability of success compared to 1 dozen,
-the money bet is the double, then the losses are larger, so it has a larger (in absolute value) slope.
-"""
-
-# Import the modules
-import random as rn
-import numpy as np
-import matplotlib.pyplot as plt
-import scipy.optimize as scop
-
-# Parameters
-MONEY = 50 # Euros
-N = int(1e6) # Number of bets
-BET = 1 # Bet money
-
-# Red or black bet
-counts = np.zeros(N)
-for i in range(N):
-    counts[i] = MONEY
-    MONEY -= BET # The bet starts
-    r = rn.randint(0, 36) # The ball is thrown
-    if r%2 == 0 and r != 0: # If even, you win
-        MONEY += 2
-
-plt.plot(counts, 'b-', label = 'Red/Black')
-
-def line(x, m, n):
-    """
-    Computes the line y = mx + n
-    """
-    return m*x + n
-
-sols = scop.curve_fit(line, np.arange(N), counts)
-m_rb, n_rb = sols[0]
-print('Slope of the red/black line =', np.round(m_rb, 4))
-
-plt.plot(m_rb*np.arange(N) + n_rb, 'k-')
-
-# One and two dozens bet
-counts_1 = np.zeros(N)
-counts_2 = np.zeros(N)
-MONEY_1 = 50
-MONEY_2 = 50
-for i in range(N):
-    counts_1[i] = MONEY_1
-    counts_2[i] = MONEY_2
-    MONEY_1 -= BET
-    MONEY_2 -= 2*BET
-    r = rn.randint(0, 36) # The ball is thrown
-    if 1 <= r <= 12:
-        MONEY_1 += 3
-    if 1 <= r <= 24:
-        MONEY_2 += 3
-
-sols = scop.curve_fit(line, np.arange(N), counts_1)
-m_1, n_1 = sols[0]
-print('Slope of the 1 dozen line =', np.round(m_1, 4))
-
-sols = scop.curve_fit(line, np.arange(N), counts_2)
-m_2, n_2 = sols[0]
-print('Slope of the 2 dozens line =', np.round(m_2, 4))
-
-plt.plot(counts_1, 'g-', label = '1 Dozen')
-plt.plot(counts_2, 'r-', label = '2 Dozens')
-
-plt.plot(m_1*np.arange(N) + n_1, 'k-')
-plt.plot(m_2*np.arange(N) + n_2, 'k-')
-
-plt.legend(fontsize = 20)
-plt.show()
+"""
+@author: HuidobroMG
+
+We simulate the Roulette game of the casino and plot the results.
+In the first part of the code, we simulate the results when the bet is just red or black.
+As a result, we see a decrease in the large number of bets limit since the 0 is not considered either red or black.
+The slope of the straight line is precisely 1/37, the probability of 0 among the 37 possible numbers.
+
+In the second part, we simulate the results when we bet on 1 or 2 dozens.
+Although it seems that 2 dozens doubles the probability of success compared to 1 dozen,
+the money bet is the double, then the losses are larger, so it has a larger (in absolute value) slope.
+
+Finally, we simulate many players at once to find the distribution of their money after a number of bets,
+including the straight up bet on a single number.
+The probability of ruin and the expected number of bets before leaving the table are also
+computed exactly, modelling the money as a Markov chain with absorbing states.
+"""
+
+# Import the modules
+import numpy as np
+import matplotlib.pyplot as plt
+import scipy.linalg as scla
+import scipy.sparse as sps
+
+# Parameters
+MONEY = 50 # Euros
+N = int(1e6) # Number of bets
+BET = 1 # Bet money
+
+# Net gain of a bet of 1 euro for each number of the roulette, 0, 1, ..., 36
+# As above, the even numbers play the role of the red ones
+numbers = np.arange(37)
+PAYOFFS = {'red_black': np.where((numbers%2 == 0) & (numbers != 0), 1, -1),
+           '1_dozen': np.where((1 <= numbers) & (numbers <= 12), 2, -1),
+           '2_dozens': np.where((1 <= numbers) & (numbers <= 24), 1, -2),
+           'straight': np.where(numbers == 17, 35, -1)}
+
+def draw_spins(n_players, n_spins, rng = None):
+    """
+    Throws the ball n_spins times for each of the n_players
+    """
+    rng = np.random.default_rng(rng)
+    return rng.integers(0, 37, size = (n_players, n_spins), dtype = np.int8)
+
+def bankrolls(spins, bet, money = MONEY, stake = BET, dtype = np.int32):
+    """
+    Computes the money of each player before each spin and after the last one
+    for the given bet type (a key of PAYOFFS), using a lookup table of the gains.
+    Integer gains are accumulated with the type dtype.
+    """
+    table = PAYOFFS[bet]*stake
+    if np.issubdtype(table.dtype, np.integer):
+        table = table.astype(dtype)
+    money_t = np.empty((spins.shape[0], spins.shape[1] + 1), dtype = table.dtype)
+    money_t[:, 0] = money
+    np.cumsum(table[spins], axis = 1, out = money_t[:, 1:])
+    money_t[:, 1:] += money
+    return money_t
+
+def simulate_bankrolls(bet, n_players, n_spins, money = MONEY, stake = BET, rng = None):
+    """
+    Simulates the money of n_players playing n_spins times the same bet
+    """
+    return bankrolls(draw_spins(n_players, n_spins, rng), bet, money, stake)
+
+# Statistics of long trajectories computed in chunks of spins
+def trajectory_stats(bet, n_spins, n_players = 1, money = MONEY, stake = BET,
+                     chunk = int(1e6), decimate = None, rng = None):
+    """
+    Computes for each player, without storing the trajectories, the least squares line
+    m*t + n of the money before each bet t = 0, ..., n_spins-1, the maximal drawdown,
+    the first bet which cannot be payed (time to ruin, -1 if it never happens) and the peak money.
+    The line is updated chunk by chunk with the running means and (co)variances of t and money.
+    If decimate is given, the money every decimate bets is also returned for plotting.
+    Each chunk holds about chunk spins in total, so that the memory does not grow with n_players.
+    """
+    rng = np.random.default_rng(rng)
+    cost = -np.min(PAYOFFS[bet])*stake
+    # The money of very long trajectories may not fit in 32 bits
+    if np.issubdtype(np.result_type(PAYOFFS[bet]*stake, money), np.integer):
+        dtype = np.int64
+    else:
+        dtype = np.float64
+    current = np.full(n_players, money, dtype = dtype)
+    chunk = max(1, chunk//n_players)
+    n = 0
+    mean_t, mean_y = 0.0, np.zeros(n_players)
+    M2_t, C_ty = 0.0, np.zeros(n_players)
+    peak = np.full(n_players, -np.inf)
+    drawdown = np.zeros(n_players)
+    ruin = np.full(n_players, -1)
+    trajectory = []
+    for t0 in range(0, n_spins, chunk):
+        c = min(chunk, n_spins - t0)
+        money_t = bankrolls(draw_spins(n_players, c, rng), bet, 0, stake, dtype = dtype)
+        money_t += current[:, None]
+        y = money_t[:, :-1]
+        current = money_t[:, -1]
+
+        # Merge the line statistics of the chunk with the previous ones
+        t = np.arange(t0, t0 + c)
+        mean_tc = t0 + (c - 1)/2
+        mean_yc = np.mean(y, axis = 1)
+        C_tyc = np.dot(y, t - mean_tc)
+        M2_tc = c*(c**2 - 1)/12
+        delta_t = mean_tc - mean_t
+        delta_y = mean_yc - mean_y
+        C_ty += C_tyc + delta_t*delta_y*n*c/(n + c)
+        M2_t += M2_tc + delta_t**2*n*c/(n + c)
+        mean_t += delta_t*c/(n + c)
+        mean_y += delta_y*c/(n + c)
+        n += c
+
+        # Peak, drawdown and ruin
+        running_peak = np.maximum(np.maximum.accumulate(y, axis = 1), peak[:, None])
+        drawdown = np.maximum(drawdown, np.max(running_peak - y, axis = 1))
+        peak = running_peak[:, -1]
+        broke = y < cost
+        first = np.argmax(broke, axis = 1)
+        new_ruin = (ruin < 0) & broke[np.arange(n_players), first]
+        ruin[new_ruin] = t0 + first[new_ruin]
+
+        if decimate is not None:
+            trajectory.append(y[:, (-t0) % decimate::decimate])
+
+    slope = C_ty/M2_t if M2_t > 0 else np.zeros(n_players)
+    stats = {'slope': slope, 'intercept': mean_y - slope*mean_t, 'max_drawdown': drawdown,
+             'ruin_time': ruin, 'peak': peak, 'final': current}
+    if decimate is not None:
+        stats['times'] = np.arange(0, n_spins, decimate)
+        stats['trajectory'] = np.concatenate(trajectory, axis = 1)
+    return stats
+
+# Exact results for a player who stops when ruined or when the money reaches a target
+def _gains(bet, stake):
+    """
+    Returns the possible gains of a bet and their probabilities
+    """
+    gains, counts = np.unique(PAYOFFS[bet]*stake, return_counts = True)
+    return gains, counts/37
+
+def transition_matrix(bet, target, stake = BET):
+    """
+    Computes the sparse transition matrix between the amounts of money 0, 1, ..., target.
+    The player is ruined (absorbing state) when the money is not enough to bet
+    and stops (absorbing state) when the money reaches the target.
+    """
+    gains, probs = _gains(bet, stake)
+    cost = -np.min(gains)
+    states = np.arange(cost, target)
+    rows = [np.arange(cost), [target]]
+    cols = [np.arange(cost), [target]]
+    vals = [np.ones(cost), [1.0]]
+    for g, p in zip(gains, probs):
+        rows.append(states)
+        cols.append(np.minimum(states + g, target))
+        vals.append(np.full(len(states), p))
+    rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+    return sps.csr_matrix((vals, (rows, cols)), shape = (target + 1, target + 1))
+
+def ruin_solver(bet, target, stake = BET):
+    """
+    Computes, for each initial money 0, 1, ..., target, the probability of ruin before
+    reaching the target and the expected number of bets until the player stops.
+    Both solve the banded linear system (I - Q) x = b, where Q is the transition matrix
+    restricted to the states in which the player keeps betting.
+    """
+    gains, probs = _gains(bet, stake)
+    cost = -np.min(gains)
+    n = target - cost
+    lower, upper = cost, max(np.max(gains), 0)
+
+    # Banded form of I - Q and the probability of being ruined in the next bet
+    ab = np.zeros((lower + upper + 1, n))
+    ab[upper] = 1
+    to_ruin = np.zeros(n)
+    states = np.arange(cost, target)
+    for g, p in zip(gains, probs):
+        new = states + g
+        transient = (new >= cost) & (new < target)
+        i = new[transient] - cost
+        j = states[transient] - cost
+        ab[upper + j - i, i] -= p
+        to_ruin[new < cost] += p
+
+    sols = scla.solve_banded((lower, upper), ab, np.column_stack((to_ruin, np.ones(n))))
+    ruin = np.concatenate((np.ones(cost), sols[:, 0], [0]))
+    spins = np.concatenate((np.zeros(cost), sols[:, 1], [0]))
+    return ruin, spins
+
+def bankroll_distribution(bet, money, target, k, stake = BET):
+    """
+    Computes the probability of each amount of money 0, 1, ..., target after k bets
+    """
+    P_T = transition_matrix(bet, target, stake).T.tocsr()
+    p = np.zeros(target + 1)
+    p[money] = 1
+    for i in range(k):
+        p = P_T @ p
+    return p
+
+# Red or black bet
+stats = trajectory_stats('red_black', N, decimate = 100)
+m_rb, n_rb = stats['slope'][0], stats['intercept'][0]
+print('Slope of the red/black line =', np.round(m_rb, 4))
+
+plt.plot(stats['times'], stats['trajectory'][0], 'b-', label = 'Red/Black')
+plt.plot(m_rb*np.arange(N) + n_rb, 'k-')
+
+# One and two dozens bet, with the same spins
+SEED = np.random.SeedSequence().entropy
+stats_1 = trajectory_stats('1_dozen', N, decimate = 100, rng = SEED)
+stats_2 = trajectory_stats('2_dozens', N, decimate = 100, rng = SEED)
+m_1, n_1 = stats_1['slope'][0], stats_1['intercept'][0]
+m_2, n_2 = stats_2['slope'][0], stats_2['intercept'][0]
+print('Slope of the 1 dozen line =', np.round(m_1, 4))
+print('Slope of the 2 dozens line =', np.round(m_2, 4))
+
+plt.plot(stats_1['times'], stats_1['trajectory'][0], 'g-', label = '1 Dozen')
+plt.plot(stats_2['times'], stats_2['trajectory'][0], 'r-', label = '2 Dozens')
+
+plt.plot(m_1*np.arange(N) + n_1, 'k-')
+plt.plot(m_2*np.arange(N) + n_2, 'k-')
+
+plt.legend(fontsize = 20)
+
+# Distribution of the money of many players after a number of bets
+N_PLAYERS = int(1e4)
+N_SPINS = int(1e3)
+
+fig = plt.figure()
+ax = fig.add_subplot(111)
+for bet, color, label in [('red_black', 'b', 'Red/Black'), ('1_dozen', 'g', '1 Dozen'),
+                          ('2_dozens', 'r', '2 Dozens'), ('straight', 'm', 'Straight up')]:
+    final = simulate_bankrolls(bet, N_PLAYERS, N_SPINS)[:, -1]
+    print('Mean final money with', label, '=', np.round(np.mean(final), 2))
+    ax.hist(final, bins = 100, histtype = 'step', color = color, label = label)
+
+ax.set_xlabel('Money after ' + str(N_SPINS) + ' bets', fontsize = 12)
+ax.set_ylabel('# of players', fontsize = 12)
+ax.legend()
+
+# Exact probability of ruin before doubling the money and expected number of bets
+TARGET = 2*MONEY
+fig = plt.figure()
+ax = fig.add_subplot(111)
+for bet, color, label in [('red_black', 'b', 'Red/Black'), ('1_dozen', 'g', '1 Dozen'),
+                          ('2_dozens', 'r', '2 Dozens'), ('straight', 'm', 'Straight up')]:
+    ruin, spins = ruin_solver(bet, TARGET)
+    print(label, ': ruin probability =', np.round(ruin[MONEY], 4),
+          ', expected number of bets =', np.round(spins[MONEY], 1))
+    ax.plot(ruin, color + '-', label = label)
+
+ax.set_xlabel('Initial money', fontsize = 12)
+ax.set_ylabel('Probability of ruin before ' + str(TARGET) + ' euros', fontsize = 12)
+ax.legend()
+
+plt.show()
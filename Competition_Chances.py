@@ -1,104 +1,228 @@
-"""
-@author: HuidobroMG
-
-In Spain, in order to be high school teacher you need to pass an exam with several stages.
-One of them consists of explaining a specific topic which is chosen by the student from a
-set of balls which have been randomly extracted.
-In the mathematics speciality, there are 75 different topics, and 5 balls are extracted.
-
-Here, we compute in two different ways the probability that at least 1 ball matches
-one of the topics that you studied.
-"""
-
-# Import the modules
-import numpy as np
-import matplotlib.pyplot as plt
-
-Nb = 5  # Number of balls
-Nt = 75  # Number of topics
-Ns = 20  # Number of topics that we have studied
-Nns = Nt - Ns  # Number of topic that we have not studied
-
-
-# Factorial function
-def factorial(number):
-    """
-    Computes the factorial of a number number
-    """
-    f = 1
-    for n in range(number, 1, -1):
-        f *= n
-    return f
-
-
-# Combinatory of two numbers
-def combinatorial(number_1, number_2):
-    """
-    Computes the combinatory of two numbers: C(number_1, number_2)
-    where number_1 >= number_2
-    0 <= number_2 <= number_1
-    """
-    return factorial(number_1) / (factorial(number_2) * factorial(number_1 - number_2))
-
-
-# Probabilities that at least 1 of the Nb balls has 1 of the Ns studied topics: p1, p2
-
-
-# Computing the opposite and substracting it to 1
-def proba_1(Nb, Nt, Nns):
-    p = 1
-    for i in range(Nb):
-        p *= (Nns - i) / (Nt - i)
-    return 1 - p
-
-
-# Computing all the possible outcomes which are favourable:
-# The first case is: only 1 of the Nb balls have 1 of Ns studied topics
-# The next cases are: 2, 3, 4... of the Nb balls have studied topics
-# The last case is: all the balls have studied topics
-# In each case we must compute all the possible combinations
-def proba_2(Nb, Nt, Ns, Nns):
-    p = []
-    p_i = 1
-    for i in range(1, Nb + 1):
-        Nt_i = Nt - (i - 1)
-        Ns_i = Ns - (i - 1)
-        p_i *= Ns_i / Nt_i
-        p.append(combinatorial(Nb, i) * p_i)
-
-    counter = 0
-    p_i = 1
-    for i in range(Nb - 1, 0, -1):
-        Nt_i = Nt - i
-        Nns_i = Nns - counter
-        p_i *= Nns_i / Nt_i
-
-        p[i - 1] *= p_i
-        counter += 1
-    return np.sum(p)
-
-
-# Print the two probabilities
-print("p1 = ", np.round(proba_1(Nb, Nt, Nns) * 100, 3), "%")
-print("p2 = ", np.round(proba_2(Nb, Nt, Ns, Nns) * 100, 3), "%")
-
-# Plot how the probabilities change with the number of balls and studied topics
-Nb = np.arange(1, 5 + 1, 1)
-Ns = np.arange(0, Nt + 1, 1)
-Nns = Nt - Ns
-
-p = np.zeros(len(Ns))
-for i in range(len(Nb)):
-    for j in range(len(Ns)):
-        p[j] = proba_1(Nb[i], Nt, Nns[j])
-
-    plt.plot(Ns, p, "-", label=str(i + 1) + " balls")
-
-plt.axhline(0.9, color="black", label="90% of probability")
-
-plt.xlabel("# of studied topics", fontsize=12)
-plt.ylabel("Probability", fontsize=12)
-
-plt.legend()
-
-plt.show()
+"""
+@author: HuidobroMG
+
+In Spain, in order to be high school teacher you need to pass an exam with several stages.
+One of them consists of explaining a specific topic which is chosen by the student from a
+set of balls which have been randomly extracted.
+In the mathematics speciality, there are 75 different topics, and 5 balls are extracted.
+
+Here, we compute in two different ways the probability that at least 1 ball matches
+one of the topics that you studied.
+Finally, the probabilities for every number of balls and studied topics are computed at once,
+together with the minimum number of topics to study to reach a given probability.
+These exact values are cross-checked with a Monte Carlo simulation of the extractions.
+"""
+
+# Import the modules
+import multiprocessing as mp
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.special import gammaln
+
+Nb = 5  # Number of balls
+Nt = 75  # Number of topics
+Ns = 20  # Number of topics that we have studied
+Nns = Nt - Ns  # Number of topic that we have not studied
+
+
+# Factorial function
+def factorial(number):
+    """
+    Computes the factorial of a number number
+    """
+    f = 1
+    for n in range(number, 1, -1):
+        f *= n
+    return f
+
+
+# Combinatory of two numbers
+def combinatorial(number_1, number_2):
+    """
+    Computes the combinatory of two numbers: C(number_1, number_2)
+    where number_1 >= number_2
+    0 <= number_2 <= number_1
+    """
+    return factorial(number_1) / (factorial(number_2) * factorial(number_1 - number_2))
+
+
+# Probabilities that at least 1 of the Nb balls has 1 of the Ns studied topics: p1, p2
+
+
+# Computing the opposite and substracting it to 1
+def proba_1(Nb, Nt, Nns):
+    p = 1
+    for i in range(Nb):
+        p *= (Nns - i) / (Nt - i)
+    return 1 - p
+
+
+# Computing all the possible outcomes which are favourable:
+# The first case is: only 1 of the Nb balls have 1 of Ns studied topics
+# The next cases are: 2, 3, 4... of the Nb balls have studied topics
+# The last case is: all the balls have studied topics
+# In each case we must compute all the possible combinations
+def proba_2(Nb, Nt, Ns, Nns):
+    p = []
+    p_i = 1
+    for i in range(1, Nb + 1):
+        Nt_i = Nt - (i - 1)
+        Ns_i = Ns - (i - 1)
+        p_i *= Ns_i / Nt_i
+        p.append(combinatorial(Nb, i) * p_i)
+
+    counter = 0
+    p_i = 1
+    for i in range(Nb - 1, 0, -1):
+        Nt_i = Nt - i
+        Nns_i = Nns - counter
+        p_i *= Nns_i / Nt_i
+
+        p[i - 1] *= p_i
+        counter += 1
+    return np.sum(p)
+
+
+# Logarithm of the combinatory, valid for arrays and large numbers
+def log_combinatorial(number_1, number_2):
+    """
+    Computes log(C(number_1, number_2)) using the log-gamma function.
+    It is -inf (C = 0) when number_2 < 0 or number_2 > number_1
+    """
+    number_1, number_2 = np.broadcast_arrays(number_1, number_2)
+    valid = (number_2 >= 0) & (number_2 <= number_1)
+    n, k = number_1[valid], number_2[valid]
+    log_c = np.full(number_1.shape, -np.inf)
+    log_c[valid] = gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+    return log_c
+
+
+# Probabilities that at least k of the Nb balls have studied topics, for arrays of Nb and Ns
+def proba_table(Nb, Nt, Ns, k=1):
+    """
+    Computes the table P[i, j] of the probability that at least k of Nb[i] balls
+    have one of the Ns[j] studied topics, out of Nt topics (hypergeometric distribution)
+    """
+    Nb = np.atleast_1d(Nb)[:, None, None]
+    Ns = np.atleast_1d(Ns)[None, :, None]
+    i = np.arange(k, np.max(Nb) + 1)[None, None, :]
+    log_p = (
+        log_combinatorial(Ns, i)
+        + log_combinatorial(Nt - Ns, Nb - i)
+        - log_combinatorial(Nt, Nb)
+    )
+    return np.minimum(np.sum(np.exp(log_p), axis=2), 1)
+
+
+# Minimum number of topics to study to reach a target probability
+def min_topics(target, Nb, Nt, k=1):
+    """
+    Computes, for each number of balls in Nb, the minimum number of studied topics such that
+    the probability that at least k balls have studied topics is at least target.
+    It is -1 when the target cannot be reached.
+    """
+    p = proba_table(Nb, Nt, np.arange(Nt + 1), k)
+    reached = p >= target
+    return np.where(np.any(reached, axis=1), np.argmax(reached, axis=1), -1)
+
+
+# Monte Carlo simulation of the extraction of the balls
+def simulate_extractions(Nb, Nt, Ns, n_trials, k=1, rng=None):
+    """
+    Counts, for each (Nb[i], Ns[j]), in how many of n_trials extractions without replacement
+    at least k of the Nb[i] balls have studied topics, the studied topics being 0, ..., Ns[j]-1.
+    In each extraction the Nt balls get random keys and the first balls are those with the
+    smallest keys (a partial shuffle, found with argpartition). At least k of them are studied
+    when the k-th smallest extracted label is below Ns[j]. All the Ns[j] share the extractions.
+    """
+    rng = np.random.default_rng(rng)
+    Nb = np.atleast_1d(Nb)
+    Ns = np.atleast_1d(Ns)
+    m = np.max(Nb)
+    keys = rng.random((n_trials, Nt))
+    if m < Nt:
+        # Labels of the m extracted balls, in the order of extraction
+        balls = np.argpartition(keys, m - 1, axis=1)[:, :m]
+        order = np.argsort(np.take_along_axis(keys, balls, axis=1), axis=1)
+        balls = np.take_along_axis(balls, order, axis=1)
+    else:
+        balls = np.argsort(keys, axis=1)
+    hits = np.zeros((len(Nb), len(Ns)), dtype=np.int64)
+    for i in range(len(Nb)):
+        if Nb[i] >= k:
+            kth = np.sort(np.sort(balls[:, : Nb[i]], axis=1)[:, k - 1])
+            hits[i] = np.searchsorted(kth, Ns, side="left")
+    return hits
+
+
+def _extraction_job(args):
+    """
+    Simulates the extractions of one job of the process pool
+    """
+    Nb, Nt, Ns, n_trials, k, seed, batch = args
+    rng = np.random.default_rng(seed)
+    hits = 0
+    for start in range(0, n_trials, batch):
+        hits = hits + simulate_extractions(Nb, Nt, Ns, min(batch, n_trials - start), k, rng)
+    return hits
+
+
+def monte_carlo_check(Nb, Nt, Ns, n_trials=int(1e6), k=1, batch=int(1e5), n_workers=None, seed=None):
+    """
+    Estimates the table of proba_table with n_trials simulated extractions, split in batches
+    among n_workers processes with independent random streams.
+    Returns the empirical probabilities and the lower and upper limits of their
+    95% (Wilson) confidence intervals.
+    """
+    n_workers = mp.cpu_count() if n_workers is None else n_workers
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+    sizes = [n_trials // n_workers + (1 if i < n_trials % n_workers else 0) for i in range(n_workers)]
+    jobs = [(Nb, Nt, Ns, sizes[i], k, seeds[i], batch) for i in range(n_workers) if sizes[i] > 0]
+    with mp.Pool(n_workers) as pool:
+        hits = np.sum(pool.map(_extraction_job, jobs), axis=0)
+
+    z = 1.96
+    p = hits / n_trials
+    centre = (p + z**2 / (2 * n_trials)) / (1 + z**2 / n_trials)
+    width = z * np.sqrt(p * (1 - p) / n_trials + z**2 / (4 * n_trials**2)) / (1 + z**2 / n_trials)
+    low = np.where(hits == 0, 0.0, centre - width)
+    high = np.where(hits == n_trials, 1.0, centre + width)
+    return p, low, high
+
+
+if __name__ == "__main__":
+    # Print the two probabilities
+    print("p1 = ", np.round(proba_1(Nb, Nt, Nns) * 100, 3), "%")
+    print("p2 = ", np.round(proba_2(Nb, Nt, Ns, Nns) * 100, 3), "%")
+
+    # Plot how the probabilities change with the number of balls and studied topics
+    Nb = np.arange(1, 5 + 1, 1)
+    Ns = np.arange(0, Nt + 1, 1)
+
+    p = proba_table(Nb, Nt, Ns)
+    for i in range(len(Nb)):
+        plt.plot(Ns, p[i], "-", label=str(i + 1) + " balls")
+
+    plt.axhline(0.9, color="black", label="90% of probability")
+
+    plt.xlabel("# of studied topics", fontsize=12)
+    plt.ylabel("Probability", fontsize=12)
+
+    plt.legend()
+
+    # Minimum number of topics to study to have a 90% of probability
+    for i, Ns_min in zip(Nb, min_topics(0.9, Nb, Nt)):
+        print(i, "balls:", Ns_min, "topics to reach 90%")
+
+    # Cross-check the exact probabilities with the simulation of the extractions
+    N_TRIALS = int(1e6)
+    p_mc, p_low, p_high = monte_carlo_check(Nb, Nt, Ns, N_TRIALS)
+    # The simulations share the random numbers for all Ns, so their errors are correlated
+    sigma = np.sqrt(p * (1 - p) / N_TRIALS) + 1e-9
+    print("Largest deviation from the exact values:", np.round(np.max(np.abs(p_mc - p) / sigma), 2), "sigma")
+    for i in range(len(Nb)):
+        j = np.argmin(np.abs(Ns - 20))
+        print(Nb[i], "balls, 20 topics: exact =", np.round(p[i, j], 4),
+              ", simulated =", np.round(p_mc[i, j], 4), "[", np.round(p_low[i, j], 4), ",", np.round(p_high[i, j], 4), "]")
+
+    plt.show()
@@ -1,96 +1,132 @@
-"""
-@author: HuidobroMG
-
-This is a simple code to show the equiprobable long-term values of different (fair) random experiments.
-In the first part we roll a die multiple times and show that:
-1. There is no statistical significance in the discrepancies in the number of times each number appears.
-2. The difference between the most and least repeated numbers decreases with the number of rolls.
-
-In the second part, we simulate the experiment of flipping a coin 10 times.
-This experiment is repeated multiple times to find the Gaussian distribution of the number of
-heads in the experiment.
-Although we can do the same with the dice, we chosed to perform the coin flip experiment,
-since it has only two possible outcomes, compared to the six of the die.
-Hence, the die experiment would require a much larger number of repetitions to see the Gaussian curve.
-"""
-
-# Import the modules
-import random as rn
-import numpy as np
-import matplotlib.pyplot as plt
-
-# The dice possibilites
-dice_values = [1, 2, 3, 4, 5, 6]
-
-# Number of runs
-N = int(5e4)
-
-results = []
-counters = np.zeros(6)
-diffs_x = []
-diffs = []
-for i in range(1, N):
-    result = rn.choice(dice_values)  # Choose randomly
-    results.append(result)
-    if i % 100 == 0:
-        for j in range(1, 7):
-            counters[j - 1] = np.count_nonzero(np.array(results) - j)
-        diffs.append(100 * (np.max(counters) - np.min(counters)) / np.min(counters))
-        diffs_x.append(i)
-
-# Plot the times each number has been obtained
-fig = plt.figure()
-ax = fig.add_subplot(111)
-ax.hist(results, bins=list(range(8)), rwidth=0.8, align="left")
-
-ax.set_xlabel("Dice values", fontsize=12)
-ax.set_ylabel("# of counts", fontsize=12)
-ax.set_xlim(0, 7)
-
-# How the differences between the times each number appears decrease with the number of runs
-fig = plt.figure()
-ax = fig.add_subplot(111)
-ax.plot(diffs_x, diffs, "-")
-
-ax.set_xlabel("Runs", fontsize=12)
-ax.set_ylabel("Mode - Antimode (%)", fontsize=12)
-
-# --------------------------------------------------------------------------------------------
-
-# A coin is thrown N times and we check the number of heads
-N = 10
-
-# The experiment is repeated N_EXP times
-N_EXP = 5000
-
-# The coin possibilites
-coin = ["heads", "tails"]
-
-results = np.zeros(N + 1)
-for i in range(N_EXP):
-    COUNTER = 0
-    for j in range(N):
-        result = rn.choice(coin)
-        if result == "heads":
-            COUNTER += 1
-    results[COUNTER] += 1
-
-# Gaussian curve
-MU = N // 2  # Mean
-SIGMA = np.sqrt(N / 4)  # Standard deviation
-
-# Gaussian distribution normalized to its integral
-x = np.linspace(0, N, 100)
-Gauss = 1 / (SIGMA * np.sqrt(2 * np.pi)) * np.exp(-((x - MU) ** 2) / (2 * SIGMA**2))
-
-# Plot the curve with the data points obtained from the experiments
-fig = plt.figure()
-ax = fig.add_subplot(111)
-
-ax.plot(list(range(N + 1)), results / N_EXP, "b.")
-ax.plot(x, Gauss, "r-")
-
-ax.set_xlabel("Number of heads", fontsize=12)
-ax.set_ylabel("Normalized counts", fontsize=12)
-
-plt.show()
+"""
+@author: HuidobroMG
+
+This is a simple code to show the equiprobable long-term values of different (fair) random experiments.
+In the first part we roll a die multiple times and show that:
+1. There is no statistical significance in the discrepancies in the number of times each number appears.
+2. The difference between the most and least repeated numbers decreases with the number of rolls.
+
+In the second part, we simulate the experiment of flipping a coin 10 times.
+This experiment is repeated multiple times to find the Gaussian distribution of the number of
+heads in the experiment.
+Although we can do the same with the dice, we chosed to perform the coin flip experiment,
+since it has only two possible outcomes, compared to the six of the die.
+Hence, the die experiment would require a much larger number of repetitions to see the Gaussian curve.
+"""
+
+# Import the modules
+import numpy as np
+import matplotlib.pyplot as plt
+
+# The dice possibilites
+dice_values = [1, 2, 3, 4, 5, 6]
+
+# Number of runs
+N = int(1e7)
+
+
+# Die rolled in chunks, keeping only the number of times each value appears
+def die_experiment(N, checkpoint=100, chunk=int(1e6), rng=None):
+    """
+    Rolls a die N times and returns the number of times each value appears and,
+    every checkpoint rolls, the difference between the most and least repeated values (in %)
+    """
+    rng = np.random.default_rng(rng)
+    chunk = max(checkpoint, chunk - chunk % checkpoint)
+    counters = np.zeros(6, dtype=np.int64)
+    diffs_x = []
+    diffs = []
+    for start in range(0, N, chunk):
+        rolls = rng.integers(0, 6, size=min(chunk, N - start))
+        n_checks = len(rolls) // checkpoint
+        if n_checks > 0:
+            # Counts of each value in the rolls between consecutive checkpoints
+            segments = rolls[: n_checks * checkpoint].reshape(n_checks, checkpoint)
+            rows = np.repeat(np.arange(n_checks), checkpoint)
+            segment_counters = np.bincount(
+                6 * rows + segments.ravel(), minlength=6 * n_checks
+            ).reshape(n_checks, 6)
+            cumulative = counters + np.cumsum(segment_counters, axis=0)
+            diffs.append(
+                100
+                * (np.max(cumulative, axis=1) - np.min(cumulative, axis=1))
+                / np.min(cumulative, axis=1)
+            )
+            diffs_x.append(start + checkpoint * np.arange(1, n_checks + 1))
+        counters += np.bincount(rolls, minlength=6)
+    if not diffs:
+        # No checkpoint was reached
+        return counters, np.zeros(0, dtype=np.int64), np.zeros(0)
+    return counters, np.concatenate(diffs_x), np.concatenate(diffs)
+
+
+counters, diffs_x, diffs = die_experiment(N)
+
+# Plot the times each number has been obtained
+fig = plt.figure()
+ax = fig.add_subplot(111)
+ax.bar(dice_values, counters, width=0.8)
+
+ax.set_xlabel("Dice values", fontsize=12)
+ax.set_ylabel("# of counts", fontsize=12)
+ax.set_xlim(0, 7)
+
+# How the differences between the times each number appears decrease with the number of runs
+fig = plt.figure()
+ax = fig.add_subplot(111)
+ax.loglog(diffs_x, diffs, "-")
+
+ax.set_xlabel("Runs", fontsize=12)
+ax.set_ylabel("Mode - Antimode (%)", fontsize=12)
+
+# --------------------------------------------------------------------------------------------
+
+# A coin is thrown N times and we check the number of heads
+N = 10
+
+# The experiment is repeated N_EXP times
+N_EXP = int(1e6)
+
+
+# Coin flips packed as the bits of 64-bit words, 1 = heads
+def coin_experiment(N, N_EXP, chunk=int(1e5), rng=None):
+    """
+    Flips a coin N times in each of the N_EXP experiments and returns the number of
+    experiments with 0, 1, ..., N heads.
+    The flips of each experiment are the random bits of ceil(N/64) words and the heads
+    are counted with a population count of the words.
+    """
+    rng = np.random.default_rng(rng)
+    n_words = -(-N // 64)
+    unused = 64 * n_words - N
+    mask = np.uint64(0xFFFFFFFFFFFFFFFF) >> np.uint64(unused)
+    results = np.zeros(N + 1, dtype=np.int64)
+    for start in range(0, N_EXP, chunk):
+        words = rng.bit_generator.random_raw((min(chunk, N_EXP - start), n_words))
+        words[:, -1] &= mask
+        heads = np.sum(np.bitwise_count(words), axis=1, dtype=np.int64)
+        results += np.bincount(heads, minlength=N + 1)
+    return results
+
+
+results = coin_experiment(N, N_EXP)
+
+# Gaussian curve
+MU = N // 2  # Mean
+SIGMA = np.sqrt(N / 4)  # Standard deviation
+
+# Gaussian distribution normalized to its integral
+x = np.linspace(0, N, 100)
+Gauss = 1 / (SIGMA * np.sqrt(2 * np.pi)) * np.exp(-((x - MU) ** 2) / (2 * SIGMA**2))
+
+# Plot the curve with the data points obtained from the experiments
+fig = plt.figure()
+ax = fig.add_subplot(111)
+
+ax.plot(list(range(N + 1)), results / N_EXP, "b.")
+ax.plot(x, Gauss, "r-")
+
+ax.set_xlabel("Number of heads", fontsize=12)
+ax.set_ylabel("Normalized counts", fontsize=12)
+
+plt.show()
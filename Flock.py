@@ -1,121 +1,520 @@
-"""
-@author: HuidobroMG
-
-We simulate and animate the flocking effect visible int he flight of some birds.
-It is based on three simple rules stated by Craig Reynolds, which are:
-Allignment (Drag force), Cohesion (Attractive force) and Separation (Repulsive force).
-"""
-
-# Import the modules
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import animation
-
-# Number of birds
-N = 100
-
-# Limits of the grid
-LIM_X = 2
-LIM_Y = 2
-
-# Random initial positions and velocities
-pos_x = LIM_X * (2 * np.random.rand(N) - 1)
-pos_y = LIM_Y * (2 * np.random.rand(N) - 1)
-vel_x = 2 * np.random.rand(N) - 1
-vel_y = 2 * np.random.rand(N) - 1
-acc_x = np.zeros(N)
-acc_y = np.zeros(N)
-
-# Interaction distance between birds
-FLOCK_D = 0.5
-
-# Maximal acceleration and velocity between birds
-MAX_ACC = 1.0
-MAX_VEL = 0.3
-
-# Evolve the system in time
-NT = int(2e3)
-DT = 1e-2
-
-x = np.zeros((NT, N))
-y = np.zeros((NT, N))
-for i in range(NT):
-    if i % 200 == 0:
-        print("i = ", i)
-    x[i] = 1.0 * pos_x
-    y[i] = 1.0 * pos_y
-
-    # Compute the interactions between neighbours
-    for j in range(N):
-        acc_x[j] = 0
-        acc_y[j] = 0
-
-        rel_d = np.sqrt((pos_x[j] - pos_x) ** 2 + (pos_y[j] - pos_y) ** 2)
-        neighbours = np.where((rel_d <= FLOCK_D) & (rel_d > 0))[0]
-        if neighbours.size > 0:
-            # Allignment
-            acc_x[j] += 2 * np.mean(vel_x[neighbours]) - vel_x[j]
-            acc_y[j] += 2 * np.mean(vel_y[neighbours]) - vel_y[j]
-            # Cohesion
-            acc_x[j] += np.mean(pos_x[neighbours]) - pos_x[j]
-            acc_y[j] += np.mean(pos_y[neighbours]) - pos_y[j]
-            # Separation
-            acc_x[j] += 0.3 * (
-                np.mean((pos_x[j] - pos_x[neighbours]) / rel_d[neighbours])
-            )
-            acc_y[j] += 0.3 * (
-                np.mean((pos_y[j] - pos_y[neighbours]) / rel_d[neighbours])
-            )
-
-            # Control the maximal value of the acceleration
-            # if abs(acc_x[j]) > max_acc:
-            #    acc_x[j] = acc_x[j]/abs(acc_x[j])*max_acc
-            # if abs(acc_y[j]) > max_acc:
-            #    acc_y[j] = acc_y[j]/abs(acc_y[j])*max_acc
-
-            # Set the maximal velocity
-            mod_v = np.sqrt(vel_x[j] ** 2 + vel_y[j] ** 2)
-            theta = np.arctan2(vel_y[j], vel_x[j])
-            if mod_v > MAX_VEL:
-                vel_x[j] = MAX_VEL * np.cos(theta)
-                vel_y[j] = MAX_VEL * np.sin(theta)
-
-    # Refresh positions and velocities
-    vel_x += DT * acc_x
-    vel_y += DT * acc_y
-    pos_x += DT * vel_x
-    pos_y += DT * vel_y
-
-    # Control the movement at the edges
-    edge_x1 = np.where(pos_x > LIM_X)[0]
-    edge_x2 = np.where(pos_x < -LIM_X)[0]
-    edge_y1 = np.where(pos_y > LIM_Y)[0]
-    edge_y2 = np.where(pos_y < -LIM_Y)[0]
-    if edge_x1.size > 0:
-        pos_x[edge_x1] -= 2 * LIM_X
-    if edge_x2.size > 0:
-        pos_x[edge_x2] += 2 * LIM_X
-    if edge_y1.size > 0:
-        pos_y[edge_y1] -= 2 * LIM_Y
-    if edge_y2.size > 0:
-        pos_y[edge_y2] += 2 * LIM_Y
-
-# Create the animation figure
-fig = plt.figure()
-ax = plt.axes(xlim=(-LIM_X, LIM_X), ylim=(-LIM_Y, LIM_Y))
-
-(line,) = ax.plot([], [], "b.")
-
-def update(frame):
-    """Update the data for the animation at each frame."""
-    line.set_data(x[frame], y[frame])
-    return (line,)
-
-
-# Animate
-ani = animation.FuncAnimation(
-    fig=fig, func=update, frames=NT, interval=2 * DT, blit=True
-)
-
-# ani.save('Flock.gif', writer = animation.PillowWriter())
-plt.show()
+"""
+@author: HuidobroMG
+
+We simulate and animate the flocking effect visible int he flight of some birds.
+It is based on three simple rules stated by Craig Reynolds, which are:
+Allignment (Drag force), Cohesion (Attractive force) and Separation (Repulsive force).
+The neighbours of each bird are searched only in the adjacent cells of a grid with cells of size FLOCK_D.
+"""
+
+# Import the modules
+import multiprocessing as mp
+import threading
+from multiprocessing import shared_memory
+from collections import deque
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib import animation
+
+# Number of birds
+N = 100
+
+# Limits of the grid
+LIM_X = 2
+LIM_Y = 2
+
+# Random initial positions and velocities
+pos_x = LIM_X * (2 * np.random.rand(N) - 1)
+pos_y = LIM_Y * (2 * np.random.rand(N) - 1)
+vel_x = 2 * np.random.rand(N) - 1
+vel_y = 2 * np.random.rand(N) - 1
+
+# Interaction distance between birds
+FLOCK_D = 0.5
+
+# Maximal acceleration and velocity between birds
+MAX_ACC = 1.0
+MAX_VEL = 0.3
+
+# Time steps
+NT = int(2e3)
+DT = 1e-2
+
+# Number of processes, each one evolving the birds in a rectangular tile of the grid
+N_WORKERS = 1
+
+# Interactions across the edges of the grid, where the birds reappear on the opposite side
+PERIODIC = True
+
+
+# Maximal number of candidate pairs of neighbours held in memory at once
+MAX_PAIRS = 2**20
+
+
+def cell_pairs(pos_x, pos_y, max_pairs=MAX_PAIRS):
+    """
+    Yields the candidate pairs of neighbours: the birds in the same or in adjacent cells
+    of a grid with cells larger than FLOCK_D, which is periodic at the edges.
+    The birds are taken by cells in groups with about max_pairs candidate pairs, so that the memory
+    does not grow with the square of the number of birds. Each group is given as the array birds
+    of its birds and the pairs (birds[i], j).
+    """
+    N = len(pos_x)
+    n_cx = max(int(2 * LIM_X / FLOCK_D), 1)
+    n_cy = max(int(2 * LIM_Y / FLOCK_D), 1)
+    cx = np.clip(((pos_x + LIM_X) * (n_cx / (2 * LIM_X))).astype(np.int64), 0, n_cx - 1)
+    cy = np.clip(((pos_y + LIM_Y) * (n_cy / (2 * LIM_Y))).astype(np.int64), 0, n_cy - 1)
+    cell = cx * n_cy + cy
+
+    # Birds sorted by cell, with the first position and number of birds of each cell
+    order = np.argsort(cell, kind="stable")
+    counts = np.bincount(cell, minlength=n_cx * n_cy)
+    starts = np.cumsum(counts) - counts
+
+    # Adjacent cells of each bird and groups of birds with about max_pairs candidates
+    neighbour_cells = [
+        ((cx + ox) % n_cx) * n_cy + (cy + oy) % n_cy
+        for ox in np.unique(np.array([-1, 0, 1]) % n_cx)
+        for oy in np.unique(np.array([-1, 0, 1]) % n_cy)
+    ]
+    if N == 0:
+        return
+    candidates = np.cumsum(sum(counts[c] for c in neighbour_cells)[order])
+    n_groups = -(-int(candidates[-1]) // max_pairs)
+    edges = np.unique(np.searchsorted(candidates, np.arange(n_groups + 1) * max_pairs, side="right"))
+
+    for a, b in zip(edges[:-1], edges[1:]):
+        birds = order[a:b]
+        local = np.arange(b - a)
+        pairs_i = []
+        pairs_j = []
+        for c in neighbour_cells:
+            k = counts[c[birds]]
+            offsets = np.arange(np.sum(k)) - np.repeat(np.cumsum(k) - k, k)
+            pairs_i.append(np.repeat(local, k))
+            pairs_j.append(order[np.repeat(starts[c[birds]], k) + offsets])
+        yield birds, np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def accelerations(pos_x, pos_y, vel_x, vel_y):
+    """
+    Computes the accelerations of all the birds due to their neighbours, closer than FLOCK_D,
+    and the number of neighbours of each bird. The sums over the neighbours are accumulated
+    group by group of candidate pairs.
+    """
+    N = len(pos_x)
+    n_neighbours = np.zeros(N, dtype=np.int64)
+    sums = np.zeros((6, N))
+    for birds, i, j in cell_pairs(pos_x, pos_y):
+        dx = pos_x[j] - pos_x[birds[i]]
+        dy = pos_y[j] - pos_y[birds[i]]
+        if PERIODIC:
+            dx -= 2 * LIM_X * np.round(dx / (2 * LIM_X))
+            dy -= 2 * LIM_Y * np.round(dy / (2 * LIM_Y))
+        rel_d = np.sqrt(dx**2 + dy**2)
+        close = (rel_d <= FLOCK_D) & (rel_d > 0)
+        i, j, dx, dy, rel_d = i[close], j[close], dx[close], dy[close], rel_d[close]
+
+        n_neighbours[birds] += np.bincount(i, minlength=len(birds))
+        for k, values in enumerate([vel_x[j], vel_y[j], dx, dy, -dx / rel_d, -dy / rel_d]):
+            sums[k, birds] += np.bincount(i, weights=values, minlength=len(birds))
+    mean_vx, mean_vy, mean_dx, mean_dy, mean_sx, mean_sy = sums / np.maximum(n_neighbours, 1)
+
+    # Allignment + Cohesion + Separation
+    acc_x = 2 * mean_vx - vel_x + mean_dx + 0.3 * mean_sx
+    acc_y = 2 * mean_vy - vel_y + mean_dy + 0.3 * mean_sy
+    acc_x[n_neighbours == 0] = 0
+    acc_y[n_neighbours == 0] = 0
+    return acc_x, acc_y, n_neighbours
+
+
+def evolve(pos_x, pos_y, vel_x, vel_y):
+    """
+    Moves the birds one time step DT, modifying the positions and velocities
+    """
+    acc_x, acc_y, n_neighbours = accelerations(pos_x, pos_y, vel_x, vel_y)
+
+    # Set the maximal velocity of the birds with neighbours
+    mod_v = np.sqrt(vel_x**2 + vel_y**2)
+    fast = (n_neighbours > 0) & (mod_v > MAX_VEL)
+    vel_x[fast] *= MAX_VEL / mod_v[fast]
+    vel_y[fast] *= MAX_VEL / mod_v[fast]
+
+    # Refresh positions and velocities
+    vel_x += DT * acc_x
+    vel_y += DT * acc_y
+    pos_x += DT * vel_x
+    pos_y += DT * vel_y
+
+    # Control the movement at the edges
+    pos_x[pos_x > LIM_X] -= 2 * LIM_X
+    pos_x[pos_x < -LIM_X] += 2 * LIM_X
+    pos_y[pos_y > LIM_Y] -= 2 * LIM_Y
+    pos_y[pos_y < -LIM_Y] += 2 * LIM_Y
+
+
+# Header of the recordings, followed by the frames (n_frames, n_fields, n_birds) in float32
+RECORD_HEADER = np.dtype(
+    [
+        ("n_birds", "<i8"),
+        ("n_frames", "<i8"),
+        ("stride", "<i8"),
+        ("n_fields", "<i8"),
+        ("dt", "<f8"),
+        ("lim_x", "<f8"),
+        ("lim_y", "<f8"),
+        ("flock_d", "<f8"),
+    ]
+)
+
+
+def record(path, pos_x, pos_y, vel_x, vel_y, NT, stride=1, velocities=False, chunk=100):
+    """
+    Evolves the system NT steps and saves the positions (and velocities if velocities is True)
+    every stride steps in a memory-mapped file. The frames are written in chunks of chunk frames.
+    """
+    n_frames = -(-NT // stride)
+    n_fields = 4 if velocities else 2
+    frames = np.memmap(
+        path,
+        dtype="<f4",
+        mode="w+",
+        offset=RECORD_HEADER.itemsize,
+        shape=(n_frames, n_fields, len(pos_x)),
+    )
+    header = np.array(
+        [(len(pos_x), n_frames, stride, n_fields, DT, LIM_X, LIM_Y, FLOCK_D)], dtype=RECORD_HEADER
+    )
+    with open(path, "r+b") as f:
+        f.write(header.tobytes())
+
+    buffer = np.zeros((chunk, n_fields, len(pos_x)), dtype=np.float32)
+    n_buffer = 0
+    n_written = 0
+    for i in range(NT):
+        if i % stride == 0:
+            buffer[n_buffer, 0] = pos_x
+            buffer[n_buffer, 1] = pos_y
+            if velocities:
+                buffer[n_buffer, 2] = vel_x
+                buffer[n_buffer, 3] = vel_y
+            n_buffer += 1
+            if n_buffer == chunk or n_written + n_buffer == n_frames:
+                frames[n_written : n_written + n_buffer] = buffer[:n_buffer]
+                frames.flush()
+                n_written += n_buffer
+                n_buffer = 0
+        evolve(pos_x, pos_y, vel_x, vel_y)
+    del frames
+
+
+def load_recording(path):
+    """
+    Reads the header of a recording and maps its frames without loading them in memory
+    """
+    header = np.fromfile(path, dtype=RECORD_HEADER, count=1)[0]
+    frames = np.memmap(
+        path,
+        dtype="<f4",
+        mode="r",
+        offset=RECORD_HEADER.itemsize,
+        shape=(int(header["n_frames"]), int(header["n_fields"]), int(header["n_birds"])),
+    )
+    return header, frames
+
+
+def _tile_layout(n_workers):
+    """
+    Chooses the numbers of tiles along x and y, with n_wx*n_wy as close as possible to n_workers
+    (and the tiles as square as possible), such that no tile is narrower than FLOCK_D
+    """
+    max_x = max(int(2 * LIM_X / FLOCK_D), 1)
+    max_y = max(int(2 * LIM_Y / FLOCK_D), 1)
+    best = (1, 1)
+    for n_wx in range(1, min(max_x, n_workers) + 1):
+        n_wy = min(max_y, n_workers // n_wx)
+        shape = abs(np.log(n_wx * LIM_Y / (n_wy * LIM_X)))
+        best_shape = abs(np.log(best[0] * LIM_Y / (best[1] * LIM_X)))
+        if n_wx * n_wy > best[0] * best[1] or (n_wx * n_wy == best[0] * best[1] and shape < best_shape):
+            best = (n_wx, n_wy)
+    return best
+
+
+def _tiles(pos_x, pos_y, n_wx, n_wy):
+    """
+    Computes the tile of the grid in which each bird is
+    """
+    tx = np.clip(((pos_x + LIM_X) * (n_wx / (2 * LIM_X))).astype(np.int64), 0, n_wx - 1)
+    ty = np.clip(((pos_y + LIM_Y) * (n_wy / (2 * LIM_Y))).astype(np.int64), 0, n_wy - 1)
+    return tx * n_wy + ty
+
+
+def _near(x, low, width, lim):
+    """
+    Checks which coordinates x are closer than FLOCK_D to the interval [low, low + width]
+    of the periodic interval [-lim, lim]
+    """
+    d = (x - low) % (2 * lim)
+    return (d <= width + FLOCK_D) | (d >= 2 * lim - FLOCK_D)
+
+
+def _tile_worker(w, n_wx, n_wy, names, N, n_steps, stride, step_barrier, frame_barrier):
+    """
+    Evolves the birds of the tile w. The state of all the birds is in shared memory:
+    at each step the worker reads its own birds and the halo of birds of the neighbouring tiles
+    closer than FLOCK_D to its edges, and writes the new state of its own birds in the other buffer.
+    Then the birds which leave the tile are sent to the outbox and the incoming birds are adopted.
+    If the worker fails, the barriers are aborted so that the other processes do not wait for it.
+    """
+    n_workers = n_wx * n_wy
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    state = np.ndarray((2, 4, N), dtype=np.float64, buffer=blocks[0].buf)
+    members = np.ndarray((n_workers, N), dtype=np.int64, buffer=blocks[1].buf)
+    n_members = np.ndarray(n_workers, dtype=np.int64, buffer=blocks[2].buf)
+    outbox = np.ndarray((n_workers, N), dtype=np.int64, buffer=blocks[3].buf)
+    n_out = np.ndarray(n_workers, dtype=np.int64, buffer=blocks[4].buf)
+
+    width_x = 2 * LIM_X / n_wx
+    width_y = 2 * LIM_Y / n_wy
+    low_x = -LIM_X + (w // n_wy) * width_x
+    low_y = -LIM_Y + (w % n_wy) * width_y
+    neighbours = {
+        ((w // n_wy + ox) % n_wx) * n_wy + (w % n_wy + oy) % n_wy
+        for ox in (-1, 0, 1)
+        for oy in (-1, 0, 1)
+    }
+    neighbours = [nb for nb in neighbours if nb != w]
+    try:
+        for step in range(n_steps):
+            if step % stride == 0:
+                frame_barrier.wait()
+                frame_barrier.wait()
+            current, new = step % 2, 1 - step % 2
+
+            # Own birds and halo from the neighbouring tiles
+            own = members[w, : n_members[w]].copy()
+            local = [own]
+            for nb in neighbours:
+                candidates = members[nb, : n_members[nb]]
+                near = _near(state[current, 0, candidates], low_x, width_x, LIM_X) & _near(
+                    state[current, 1, candidates], low_y, width_y, LIM_Y
+                )
+                local.append(candidates[near])
+            local = np.concatenate(local)
+            local_state = state[current][:, local]
+            evolve(*local_state)
+            state[new][:, own] = local_state[:, : len(own)]
+            step_barrier.wait()
+
+            # Birds leaving the tile
+            tile = _tiles(state[new, 0, own], state[new, 1, own], n_wx, n_wy)
+            leaving = own[tile != w]
+            outbox[w, : len(leaving)] = leaving
+            n_out[w] = len(leaving)
+            step_barrier.wait()
+
+            # Birds arriving to the tile
+            incoming = [own[tile == w]]
+            for other in range(n_workers):
+                if other != w and n_out[other] > 0:
+                    candidates = outbox[other, : n_out[other]]
+                    arriving = _tiles(state[new, 0, candidates], state[new, 1, candidates], n_wx, n_wy) == w
+                    incoming.append(candidates[arriving])
+            incoming = np.concatenate(incoming)
+            members[w, : len(incoming)] = incoming
+            n_members[w] = len(incoming)
+            step_barrier.wait()
+
+        frame_barrier.wait()
+        frame_barrier.wait()
+    except threading.BrokenBarrierError:
+        # Another process failed or the evolution was stopped
+        pass
+    except BaseException:
+        step_barrier.abort()
+        frame_barrier.abort()
+        raise
+    finally:
+        del state, members, n_members, outbox, n_out
+        for block in blocks:
+            block.close()
+
+
+def parallel_frames(pos_x, pos_y, vel_x, vel_y, n_steps, stride=1, n_workers=N_WORKERS):
+    """
+    Evolves the system n_steps with the grid divided in n_workers rectangular tiles, each one in
+    a different process, and yields the positions and velocities every stride steps (starting with
+    the initial ones). The given arrays are updated with the final state.
+    The tiles cannot be narrower than FLOCK_D, so at most (2*LIM_X/FLOCK_D)*(2*LIM_Y/FLOCK_D)
+    processes are used (64 with the default grid), and fewer if n_workers cannot be split in tiles.
+    If a worker fails, a RuntimeError is raised instead of waiting for it.
+    """
+    n_wx, n_wy = _tile_layout(max(1, n_workers))
+    if n_wx * n_wy < n_workers:
+        print("Warning: only", n_wx * n_wy, "tiles of the grid are used, instead of", n_workers)
+    n_workers = n_wx * n_wy
+    N = len(pos_x)
+    shapes = [(2, 4, N), (n_workers, N), (n_workers,), (n_workers, N), (n_workers,)]
+    dtypes = [np.float64, np.int64, np.int64, np.int64, np.int64]
+    blocks = [
+        shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 8))
+        for shape in shapes
+    ]
+    arrays = [
+        np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        for shape, dtype, block in zip(shapes, dtypes, blocks)
+    ]
+    state, members, n_members = arrays[0], arrays[1], arrays[2]
+    state[0] = np.array([pos_x, pos_y, vel_x, vel_y])
+    tile = _tiles(pos_x, pos_y, n_wx, n_wy)
+    for w in range(n_workers):
+        own = np.where(tile == w)[0]
+        members[w, : len(own)] = own
+        n_members[w] = len(own)
+
+    step_barrier = mp.Barrier(n_workers)
+    frame_barrier = mp.Barrier(n_workers + 1)
+    names = [block.name for block in blocks]
+    workers = [
+        mp.Process(
+            target=_tile_worker,
+            args=(w, n_wx, n_wy, names, N, n_steps, stride, step_barrier, frame_barrier),
+            daemon=True,
+        )
+        for w in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    # Watch the workers, breaking the barriers if one of them dies (even without an exception)
+    stop = threading.Event()
+
+    def watch():
+        while not stop.wait(0.1):
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                step_barrier.abort()
+                frame_barrier.abort()
+                return
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    try:
+        try:
+            for step in range(0, n_steps, stride):
+                frame_barrier.wait()
+                frame = state[step % 2].copy()
+                frame_barrier.wait()
+                yield frame
+            frame_barrier.wait()
+            pos_x[:], pos_y[:], vel_x[:], vel_y[:] = state[n_steps % 2]
+            frame_barrier.wait()
+        except threading.BrokenBarrierError:
+            for worker in workers:
+                worker.join(1)
+            codes = [worker.exitcode for worker in workers]
+            raise RuntimeError("A worker of the flock failed, exit codes: " + str(codes)) from None
+        for worker in workers:
+            worker.join()
+    finally:
+        stop.set()
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        del state, members, n_members, arrays
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def flock_frames(pos_x, pos_y, vel_x, vel_y, steps_per_frame=1):
+    """
+    Yields the positions and velocities of the birds, evolving the system
+    steps_per_frame steps between frames, without end
+    """
+    while True:
+        yield np.array([pos_x, pos_y, vel_x, vel_y])
+        for k in range(steps_per_frame):
+            evolve(pos_x, pos_y, vel_x, vel_y)
+
+
+if __name__ == "__main__":
+    # Evolve the system while it is animated (LIVE = 1), STEPS_PER_FRAME steps per frame,
+    # keeping only the last TRAIL frames to draw the trails of the birds
+    LIVE = 1
+    STEPS_PER_FRAME = 2
+    TRAIL = 10
+
+    # Otherwise, keep all the steps in memory (RECORD = 0) or save them every STRIDE steps in a file (RECORD = 1)
+    RECORD = 0
+    STRIDE = 1
+
+    # Create the animation figure
+    fig = plt.figure()
+    ax = plt.axes(xlim=(-LIM_X, LIM_X), ylim=(-LIM_Y, LIM_Y))
+
+    (trail_line,) = ax.plot([], [], ".", color="lightblue", markersize=2)
+    (line,) = ax.plot([], [], "b.")
+
+    if LIVE == 1:
+        if N_WORKERS > 1:
+            frames = parallel_frames(pos_x, pos_y, vel_x, vel_y, 2**62, STEPS_PER_FRAME)
+        else:
+            frames = flock_frames(pos_x, pos_y, vel_x, vel_y, STEPS_PER_FRAME)
+        trail = deque(maxlen=TRAIL)
+
+        def update(frame):
+            """Evolve the system and update the data for the animation at each frame."""
+            state = next(frames)
+            trail.append(state[:2])
+            line.set_data(state[0], state[1])
+            trail_line.set_data(
+                np.concatenate([old[0] for old in trail]),
+                np.concatenate([old[1] for old in trail]),
+            )
+            ax.set_title("i = " + str(frame * STEPS_PER_FRAME))
+            return (trail_line, line)
+
+        # Animate
+        ani = animation.FuncAnimation(
+            fig=fig, func=update, interval=2 * DT, blit=False, cache_frame_data=False
+        )
+
+    else:
+        if RECORD == 1:
+            record("Flock.dat", pos_x, pos_y, vel_x, vel_y, NT, stride=STRIDE)
+            header, frames = load_recording("Flock.dat")
+            x = frames[:, 0]
+            y = frames[:, 1]
+        else:
+            x = np.zeros((NT, N))
+            y = np.zeros((NT, N))
+            if N_WORKERS > 1:
+                for i, frame in enumerate(parallel_frames(pos_x, pos_y, vel_x, vel_y, NT)):
+                    if i % 200 == 0:
+                        print("i = ", i)
+                    x[i] = frame[0]
+                    y[i] = frame[1]
+            else:
+                for i in range(NT):
+                    if i % 200 == 0:
+                        print("i = ", i)
+                    x[i] = 1.0 * pos_x
+                    y[i] = 1.0 * pos_y
+                    evolve(pos_x, pos_y, vel_x, vel_y)
+
+        def update(frame):
+            """Update the data for the animation at each frame."""
+            line.set_data(x[frame], y[frame])
+            return (line,)
+
+        # Animate
+        ani = animation.FuncAnimation(
+            fig=fig, func=update, frames=len(x), interval=2 * DT, blit=True
+        )
+
+    # ani.save('Flock.gif', writer = animation.PillowWriter())
+    plt.show()
+
+    # Stop the workers of the unfinished live evolution and free the shared memory
+    if LIVE == 1:
+        frames.close()
@@ -1,157 +1,627 @@
-"""
-@author: HuidobroMG
-
-The Conway's Game of Life is implemented and animated in time following the 4 simple rules.
-We start with random initial positions and leave the algorithm run.
-
-There are multiple possible scenarios that may occur, like:
-total annihilation, periodic patterns, (possibly) eternal animations, among others.
-Some movements seem to simulate spaceships and battles between them,
-and indeed for sufficiently large grids some aspects of physical reality seems to be replicated.
-"""
-
-# Import the modules
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import random as rn
-
-# Size of the grid
-N = 50
-
-# Initial configuration
-init_grid = np.zeros((N, N))
-Nr = 500
-for i in range(Nr):
-    xr = rn.randint(0, N-1)
-    yr = rn.randint(0, N-1)
-    init_grid[xr, yr] = 1
-
-grid = 1*init_grid
-
-# Function that counts the neighbours
-def neighbours(i, j):
-    n_neighbours = 0
-    if i == 0:
-        if j == 0:
-            if init_grid[i+1, j] == 1:
-                n_neighbours += 1
-            if init_grid[i, j+1] == 1:
-                n_neighbours += 1
-            if init_grid[i+1, j+1] == 1:
-                n_neighbours += 1
-        elif j == N-1:
-            if init_grid[i+1, j] == 1:
-                n_neighbours += 1
-            if init_grid[i, j-1] == 1:
-                n_neighbours += 1
-            if init_grid[i+1, j-1] == 1:
-                n_neighbours += 1
-        else:
-            if init_grid[i+1, j] == 1:
-                n_neighbours += 1
-            if init_grid[i, j+1] == 1:
-                n_neighbours += 1
-            if init_grid[i, j-1] == 1:
-                n_neighbours += 1
-            if init_grid[i+1, j+1] == 1:
-                n_neighbours += 1
-            if init_grid[i+1, j-1] == 1:
-                n_neighbours += 1
-    elif i == N-1:
-        if j == 0:
-            if init_grid[i-1, j] == 1:
-                n_neighbours += 1
-            if init_grid[i, j+1] == 1:
-                n_neighbours += 1
-            if init_grid[i-1, j+1] == 1:
-                n_neighbours += 1
-        elif j == N-1:
-            if init_grid[i-1, j] == 1:
-                n_neighbours += 1
-            if init_grid[i, j-1] == 1:
-                n_neighbours += 1
-            if init_grid[i-1, j-1] == 1:
-                n_neighbours += 1
-        else:
-            if init_grid[i-1, j] == 1:
-                n_neighbours += 1
-            if init_grid[i-1, j-1] == 1:
-                n_neighbours += 1
-            if init_grid[i-1, j+1] == 1:
-                n_neighbours += 1
-            if init_grid[i, j-1] == 1:
-                n_neighbours += 1
-            if init_grid[i, j+1] == 1:
-                n_neighbours += 1
-    elif j == 0:
-        if init_grid[i+1, j] == 1:
-            n_neighbours += 1
-        if init_grid[i-1, j] == 1:
-            n_neighbours += 1
-        if init_grid[i+1, j+1] == 1:
-            n_neighbours += 1
-        if init_grid[i-1, j+1] == 1:
-            n_neighbours += 1
-        if init_grid[i, j+1] == 1:
-            n_neighbours += 1
-    elif j == N-1:
-        if init_grid[i+1, j] == 1:
-            n_neighbours += 1
-        if init_grid[i-1, j] == 1:
-            n_neighbours += 1
-        if init_grid[i+1, j-1] == 1:
-            n_neighbours += 1
-        if init_grid[i-1, j-1] == 1:
-            n_neighbours += 1
-        if init_grid[i, j-1] == 1:
-            n_neighbours += 1
-    else:
-        if init_grid[i-1, j] == 1:
-            n_neighbours += 1
-        if init_grid[i+1, j] == 1:
-            n_neighbours += 1
-        if init_grid[i, j-1] == 1:
-            n_neighbours += 1
-        if init_grid[i, j+1] == 1:
-            n_neighbours += 1
-        if init_grid[i-1, j+1] == 1:
-            n_neighbours += 1
-        if init_grid[i-1, j-1] == 1:
-            n_neighbours += 1
-        if init_grid[i+1, j-1] == 1:
-            n_neighbours += 1
-        if init_grid[i+1, j+1] == 1:
-            n_neighbours += 1
-    return n_neighbours
-
-# Iterate life
-iterations = 100
-grid_t = np.zeros(((N, N, iterations)))
-grid_t[:, :, 0] = 1*init_grid
-for i in range(1, iterations):
-    for x in range(N):
-        for y in range(N):        
-            n = neighbours(x, y)
-            if init_grid[x, y] == 1 and n < 2:
-                grid[x, y] = 0
-            elif init_grid[x, y] == 1 and n > 3:
-                grid[x, y] = 0
-            elif init_grid[x, y] == 0 and n == 3:
-                grid[x, y] = 1
-    grid_t[:,:, i] = 1*grid
-    init_grid = 1*grid
-
-# Animation
-def animate(i, img, ax):
-    img.set_data(grid_t[:,:,i])
-    ax.set_title('i = '+str(i))
-    return img
-
-fig, ax = plt.subplots()
-img = ax.imshow(grid_t[:,:,0], interpolation = 'nearest')
-ani = animation.FuncAnimation(fig, animate, fargs = (img, ax, ),
-                              frames = iterations, interval = 100,
-                              repeat = False)
-
-plt.show()
\ No newline at end of file
+"""
+@author: HuidobroMG
+
+The Conway's Game of Life is implemented and animated in time following the 4 simple rules.
+We start with random initial positions and leave the algorithm run.
+
+There are multiple possible scenarios that may occur, like:
+total annihilation, periodic patterns, (possibly) eternal animations, among others.
+Some movements seem to simulate spaceships and battles between them,
+and indeed for sufficiently large grids some aspects of physical reality seems to be replicated.
+Other Life-like games may be played by changing the rules, given as a string 'B3/S23'
+with the numbers of neighbours for which a cell is born (B) or survives (S).
+"""
+
+# Import the modules
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import random as rn
+import hashlib
+
+# Size of the grid
+N = 50
+
+# Initial configuration
+init_grid = np.zeros((N, N))
+Nr = 500
+for i in range(Nr):
+    xr = rn.randint(0, N-1)
+    yr = rn.randint(0, N-1)
+    init_grid[xr, yr] = 1
+
+# Rules of the game: a dead cell is born with 3 neighbours and a live cell survives with 2 or 3
+RULE = 'B3/S23'
+
+# Cells outside the grid are dead ('dead') or the grid is periodic ('torus')
+BOUNDARY = 'dead'
+
+def parse_rule(rule):
+    """
+    Converts a rule string 'Bxxx/Syyy' into two boolean arrays, indexed by the number
+    of neighbours, for the birth of dead cells and the survival of live cells
+    """
+    birth = np.zeros(9, dtype = bool)
+    survival = np.zeros(9, dtype = bool)
+    for part in rule.upper().split('/'):
+        if part.startswith('B'):
+            birth[[int(n) for n in part[1:]]] = True
+        elif part.startswith('S'):
+            survival[[int(n) for n in part[1:]]] = True
+        else:
+            raise ValueError('Invalid rule ' + rule)
+    return birth, survival
+
+# Function that counts the neighbours of every cell
+def neighbours(grid, boundary = BOUNDARY):
+    """
+    Computes the number of live neighbours of every cell as the sum of the 8 shifted grids
+    """
+    padded = np.pad(grid.astype(np.uint8), 1, mode = 'wrap' if boundary == 'torus' else 'constant')
+    n_x, n_y = grid.shape
+    counts = np.zeros((n_x, n_y), dtype = np.uint8)
+    for dx in range(3):
+        for dy in range(3):
+            if dx != 1 or dy != 1:
+                counts += padded[dx:dx+n_x, dy:dy+n_y]
+    return counts
+
+def life_step(grid, rule = RULE, boundary = BOUNDARY):
+    """
+    Computes the next generation of the grid
+    """
+    birth, survival = parse_rule(rule)
+    n = neighbours(grid, boundary)
+    return np.where(grid == 1, survival[n], birth[n]).astype(grid.dtype)
+
+# Sparse evolution: only the tiles of the grid next to a change in the last generation are computed
+TILE = 16
+
+def sparse_step(grid, active, tile = TILE, rule = RULE, boundary = BOUNDARY):
+    """
+    Computes in place the next generation of the cells of the active tiles (a boolean array
+    with one element for each tile x tile square of the grid). The rest of the cells cannot change.
+    Returns the grid, the tiles which must be computed in the next generation
+    (the tiles which changed and their neighbours) and the indices of the tiles which changed.
+    """
+    birth, survival = parse_rule(rule)
+    n_x, n_y = grid.shape
+    tiles = np.argwhere(active)
+    if len(tiles) == 0:
+        return grid, np.zeros_like(active), tiles
+
+    # Windows of the active tiles with one cell of margin
+    offsets = np.arange(-1, tile + 1)
+    rows = tiles[:, 0, None]*tile + offsets
+    cols = tiles[:, 1, None]*tile + offsets
+    if boundary == 'torus':
+        windows = grid[(rows % n_x)[:, :, None], (cols % n_y)[:, None, :]].astype(np.uint8)
+    else:
+        valid = ((rows >= 0) & (rows < n_x))[:, :, None] & ((cols >= 0) & (cols < n_y))[:, None, :]
+        windows = grid[np.clip(rows, 0, n_x - 1)[:, :, None], np.clip(cols, 0, n_y - 1)[:, None, :]]
+        windows = windows.astype(np.uint8)*valid
+
+    n = np.zeros((len(tiles), tile, tile), dtype = np.uint8)
+    for dx in range(3):
+        for dy in range(3):
+            if dx != 1 or dy != 1:
+                n += windows[:, dx:dx+tile, dy:dy+tile]
+    old = windows[:, 1:-1, 1:-1]
+    new = np.where(old == 1, survival[n], birth[n]).astype(np.uint8)
+
+    # Write the new cells inside the grid
+    inside_rows, inside_cols = np.broadcast_arrays(rows[:, 1:-1, None], cols[:, None, 1:-1])
+    inside = (inside_rows < n_x) & (inside_cols < n_y)
+    grid[inside_rows[inside], inside_cols[inside]] = new[inside]
+
+    # Tiles which changed (only the cells inside the grid) and their neighbours
+    changed = tiles[np.any((new != old) & inside, axis = (1, 2))]
+    n_tx, n_ty = active.shape
+    new_active = np.zeros_like(active)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            tx = changed[:, 0] + dx
+            ty = changed[:, 1] + dy
+            if boundary == 'torus':
+                new_active[tx % n_tx, ty % n_ty] = True
+            else:
+                valid = (tx >= 0) & (tx < n_tx) & (ty >= 0) & (ty < n_ty)
+                new_active[tx[valid], ty[valid]] = True
+    return grid, new_active, changed
+
+def _tile_cells(tiles, tile, shape):
+    """
+    Computes the rows and columns of the cells of the tiles, clipped to the grid,
+    and the mask of the cells which are inside the grid
+    """
+    n_x, n_y = shape
+    offsets = np.arange(tile)
+    rows, cols = np.broadcast_arrays((tiles[:, 0, None]*tile + offsets)[:, :, None],
+                                     (tiles[:, 1, None]*tile + offsets)[:, None, :])
+    inside = (rows < n_x) & (cols < n_y)
+    return np.minimum(rows, n_x - 1), np.minimum(cols, n_y - 1), inside
+
+def tile_codes(grid, tiles, tile = TILE):
+    """
+    Packs the cells of each of the tiles into tile*tile/8 bytes (cells outside the grid are dead)
+    """
+    rows, cols, inside = _tile_cells(tiles, tile, grid.shape)
+    cells = grid[rows, cols]*inside
+    return np.packbits(cells.reshape(len(tiles), -1), axis = 1)
+
+def tile_hashes(codes, tiles, n_ty):
+    """
+    Computes a 64-bit hash of the contents and the position of each tile.
+    The hash of a grid is the XOR of the hashes of all its tiles, so that it can be
+    updated with the tiles which changed.
+    """
+    n_words = -(-codes.shape[1]//8)
+    words = np.zeros((len(codes), 8*n_words), dtype = np.uint8)
+    words[:, :codes.shape[1]] = codes
+    words = words.view('<u8')
+    odd = np.uint64(0x9E3779B97F4A7C15)*(2*np.arange(n_words + 1, dtype = np.uint64) + np.uint64(1))
+    position = (tiles[:, 0]*n_ty + tiles[:, 1]).astype(np.uint64)
+    h = np.sum(words*odd[:-1], axis = 1, dtype = np.uint64) + position*odd[-1]
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xFF51AFD7ED558CCD)
+    h ^= h >> np.uint64(33)
+    return h
+
+# Bit-packed grids: each row is stored in 64-bit words, with the cell of column 64*w + k
+# in the bit k of the word w
+def pack_grid(grid, block_rows = 1024):
+    """
+    Packs a grid of 0 and 1 into an array of 64-bit words, one row of words for each row of the grid.
+    The grid is packed in blocks of rows, so that only one block is stored with a byte per cell.
+    """
+    n_x, n_y = grid.shape
+    n_words = -(-n_y//64)
+    words = np.empty((n_x, n_words), dtype = '<u8')
+    for r0 in range(0, n_x, block_rows):
+        r1 = min(r0 + block_rows, n_x)
+        bits = np.zeros((r1 - r0, 64*n_words), dtype = np.uint8)
+        bits[:, :n_y] = grid[r0:r1]
+        words[r0:r1] = np.packbits(bits, axis = 1, bitorder = 'little').view('<u8')
+    return words
+
+def random_words(n_x, n_y, rng = None):
+    """
+    Generates a random packed grid with n_x rows and n_y columns, in which each cell is alive
+    with probability 1/2, directly as random 64-bit words
+    """
+    rng = np.random.default_rng(rng)
+    words = rng.bit_generator.random_raw((n_x, -(-n_y//64))).astype('<u8', copy = False)
+    if n_y % 64 != 0:
+        words[:, -1] &= (np.uint64(1) << np.uint64(n_y % 64)) - np.uint64(1)
+    return words
+
+def unpack_grid(words, n_y):
+    """
+    Unpacks the words into a grid of 0 and 1 with n_y columns
+    """
+    bits = np.unpackbits(words.astype('<u8').view(np.uint8), axis = 1, bitorder = 'little')
+    return bits[:, :n_y]
+
+def _full_adder(a, b, c):
+    """
+    Adds three bit-planes, returning the bit-planes of the sum and the carry
+    """
+    a_xor_b = a ^ b
+    return a_xor_b ^ c, (a & b) | (c & a_xor_b)
+
+def _shift_words(rows, n_y, boundary):
+    """
+    Shifts the packed rows one cell, returning the west (column - 1) and east (column + 1) neighbours
+    """
+    one = np.uint64(1)
+    top = np.uint64(63)
+    previous = np.zeros_like(rows)
+    following = np.zeros_like(rows)
+    previous[:, 1:] = rows[:, :-1]
+    following[:, :-1] = rows[:, 1:]
+    r = n_y % 64
+    if boundary == 'torus':
+        previous[:, 0] = ((rows[:, -1] >> np.uint64((n_y - 1) % 64)) & one) << top
+        if r == 0:
+            following[:, -1] = rows[:, 0]
+    west = (rows << one) | (previous >> top)
+    east = (rows >> one) | (following << top)
+    if boundary == 'torus' and r != 0:
+        east[:, -1] |= (rows[:, 0] & one) << np.uint64(r - 1)
+    return west, east
+
+def packed_step(words, n_y, rule = RULE, boundary = BOUNDARY, block_rows = 1024):
+    """
+    Computes the next generation of a packed grid with n_y columns, 64 cells at a time.
+    The 8 neighbours of all the cells of a word are added with bit-sliced full adders
+    into the 4 bit-planes of the number of neighbours. The grid is processed in blocks of rows.
+    """
+    birth, survival = parse_rule(rule)
+    n_x, n_words = words.shape
+    full = np.uint64(0xFFFFFFFFFFFFFFFF)
+    new_words = np.zeros_like(words)
+    for r0 in range(0, n_x, block_rows):
+        r1 = min(r0 + block_rows, n_x)
+
+        # Rows of the block with the rows above and below
+        rows = np.arange(r0 - 1, r1 + 1)
+        if boundary == 'torus':
+            extended = words[rows % n_x]
+        else:
+            extended = np.zeros((len(rows), n_words), dtype = words.dtype)
+            inside = (rows >= 0) & (rows < n_x)
+            extended[inside] = words[rows[inside]]
+        west, east = _shift_words(extended, n_y, boundary)
+
+        # Number of neighbours in 4 bit-planes
+        sum_a, carry_a = _full_adder(extended[:-2], west[:-2], east[:-2])
+        sum_b, carry_b = _full_adder(extended[2:], west[2:], east[2:])
+        sum_c, carry_c = west[1:-1] ^ east[1:-1], west[1:-1] & east[1:-1]
+        bit_0, carry_d = _full_adder(sum_a, sum_b, sum_c)
+        twos, fours_a = _full_adder(carry_a, carry_b, carry_c)
+        bit_1, fours_b = twos ^ carry_d, twos & carry_d
+        bit_2, bit_3 = fours_a ^ fours_b, fours_a & fours_b
+        bits = [bit_0, bit_1, bit_2, bit_3]
+
+        def equal(n):
+            result = np.full_like(bit_0, full)
+            for k in range(4):
+                result &= bits[k] if (n >> k) & 1 else ~bits[k]
+            return result
+
+        alive = extended[1:-1]
+        born = np.zeros_like(alive)
+        survive = np.zeros_like(alive)
+        for n in range(9):
+            if birth[n]:
+                born |= equal(n)
+            if survival[n]:
+                survive |= equal(n)
+        new_words[r0:r1] = (born & ~alive) | (survive & alive)
+
+    # Clear the bits beyond the last column
+    if n_y % 64 != 0:
+        new_words[:, -1] &= (np.uint64(1) << np.uint64(n_y % 64)) - np.uint64(1)
+    return new_words
+
+# HashLife: the plane is a quadtree of canonical nodes, and the evolution of each node
+# is memoized, so that repeated patterns and far generations are computed only once
+class Node:
+    """
+    Node of level k of the quadtree, a square of 2**k x 2**k cells, made of four nodes of level k-1.
+    The nodes of level 0 are single cells.
+    """
+    __slots__ = ('k', 'nw', 'ne', 'sw', 'se', 'population')
+
+    def __init__(self, k, nw, ne, sw, se, population):
+        self.k = k
+        self.nw, self.ne, self.sw, self.se = nw, ne, sw, se
+        self.population = population
+
+OFF = Node(0, None, None, None, None, 0)
+ON = Node(0, None, None, None, None, 1)
+
+# Maximal number of nodes in the cache before the garbage collection
+CACHE_LIMIT = 2**20
+
+_nodes = {}
+_zeros = {0: OFF}
+_results = {}
+_results_rule = [RULE]
+
+def join(nw, ne, sw, se):
+    """
+    Returns the canonical node with the four given children
+    """
+    key = (nw, ne, sw, se)
+    node = _nodes.get(key)
+    if node is None:
+        node = Node(nw.k + 1, nw, ne, sw, se,
+                    nw.population + ne.population + sw.population + se.population)
+        _nodes[key] = node
+    return node
+
+def zero(k):
+    """
+    Returns the empty node of level k
+    """
+    if k not in _zeros:
+        z = zero(k - 1)
+        _zeros[k] = join(z, z, z, z)
+    return _zeros[k]
+
+def centre(m):
+    """
+    Returns the node of level k+1 with the node m of level k in its centre
+    """
+    z = zero(m.k - 1)
+    return join(join(z, z, z, m.nw), join(z, z, m.ne, z),
+                join(z, m.sw, z, z), join(m.se, z, z, z))
+
+def inner(m):
+    """
+    Returns the central node of level k-1 of the node m
+    """
+    return join(m.nw.se, m.ne.sw, m.sw.ne, m.se.nw)
+
+def _life_4x4(m, rule):
+    """
+    Computes the next generation of the central 2x2 cells of a node of level 2
+    """
+    birth, survival = parse_rule(rule)
+    cells = np.zeros((4, 4), dtype = np.uint8)
+    for r, row in enumerate([(m.nw, m.ne), (m.sw, m.se)]):
+        for c, child in enumerate(row):
+            cells[2*r:2*r+2, 2*c:2*c+2] = [[child.nw.population, child.ne.population],
+                                           [child.sw.population, child.se.population]]
+    new = []
+    for i in (1, 2):
+        for j in (1, 2):
+            n = np.sum(cells[i-1:i+2, j-1:j+2]) - cells[i, j]
+            new.append(ON if (survival[n] if cells[i, j] else birth[n]) else OFF)
+    return join(*new)
+
+def successor(m, j, rule = RULE):
+    """
+    Computes the central node of level k-1 of the node m of level k after 2**j generations,
+    where j <= k-2
+    """
+    if m.population == 0:
+        return zero(m.k - 1)
+    key = (m, j)
+    if key in _results:
+        return _results[key]
+    if m.k == 2:
+        s = _life_4x4(m, rule)
+    else:
+        a, b, c, d = m.nw, m.ne, m.sw, m.se
+        c1 = successor(join(a.nw, a.ne, a.sw, a.se), j, rule)
+        c2 = successor(join(a.ne, b.nw, a.se, b.sw), j, rule)
+        c3 = successor(join(b.nw, b.ne, b.sw, b.se), j, rule)
+        c4 = successor(join(a.sw, a.se, c.nw, c.ne), j, rule)
+        c5 = successor(join(a.se, b.sw, c.ne, d.nw), j, rule)
+        c6 = successor(join(b.sw, b.se, d.nw, d.ne), j, rule)
+        c7 = successor(join(c.nw, c.ne, c.sw, c.se), j, rule)
+        c8 = successor(join(c.ne, d.nw, c.se, d.sw), j, rule)
+        c9 = successor(join(d.nw, d.ne, d.sw, d.se), j, rule)
+        if j < m.k - 2:
+            s = join(join(c1.se, c2.sw, c4.ne, c5.nw), join(c2.se, c3.sw, c5.ne, c6.nw),
+                     join(c4.se, c5.sw, c7.ne, c8.nw), join(c5.se, c6.sw, c8.ne, c9.nw))
+        else:
+            s = join(successor(join(c1, c2, c4, c5), j, rule), successor(join(c2, c3, c5, c6), j, rule),
+                     successor(join(c4, c5, c7, c8), j, rule), successor(join(c5, c6, c8, c9), j, rule))
+    _results[key] = s
+    return s
+
+def hashlife_gc(*roots):
+    """
+    Removes from the cache the nodes which cannot be reached from the roots
+    and forgets the memoized generations
+    """
+    global _nodes
+    alive = set()
+    stack = list(roots) + list(_zeros.values())
+    while stack:
+        node = stack.pop()
+        if node.k > 0 and node not in alive:
+            alive.add(node)
+            stack.extend((node.nw, node.ne, node.sw, node.se))
+    _nodes = {key: node for key, node in _nodes.items() if node in alive}
+    _results.clear()
+
+def hashlife_advance(node, r0, c0, n, rule = RULE):
+    """
+    Advances n generations the node whose top left cell is at row r0 and column c0
+    of the infinite plane, jumping 2**j generations for each bit j of n.
+    Returns the new node and the position of its top left cell.
+    """
+    if rule != _results_rule[0]:
+        _results.clear()
+        _results_rule[0] = rule
+    j = 0
+    while n > 0:
+        if n & 1:
+            # Enough empty space around the pattern for 2**j generations
+            while node.k < max(j + 1, 2):
+                r0, c0 = r0 - 2**(node.k - 1), c0 - 2**(node.k - 1)
+                node = centre(node)
+            for pad in range(2):
+                r0, c0 = r0 - 2**(node.k - 1), c0 - 2**(node.k - 1)
+                node = centre(node)
+            node = successor(node, j, rule)
+            r0, c0 = r0 + 2**(node.k - 1), c0 + 2**(node.k - 1)
+
+            # Remove the empty space
+            while node.k > 3 and inner(node).population == node.population:
+                r0, c0 = r0 + 2**(node.k - 2), c0 + 2**(node.k - 2)
+                node = inner(node)
+            if len(_nodes) > CACHE_LIMIT:
+                hashlife_gc(node)
+        n >>= 1
+        j += 1
+    return node, r0, c0
+
+def from_grid(grid):
+    """
+    Converts a grid of 0 and 1 into a node, returning the node and the position (0, 0)
+    of its top left cell
+    """
+    k = max(2, int(np.ceil(np.log2(max(grid.shape)))))
+    square = np.zeros((2**k, 2**k), dtype = np.uint8)
+    square[:grid.shape[0], :grid.shape[1]] = grid
+
+    def build(r, c, k):
+        if k == 0:
+            return ON if square[r, c] else OFF
+        if not np.any(square[r:r+2**k, c:c+2**k]):
+            return zero(k)
+        h = 2**(k - 1)
+        return join(build(r, c, k - 1), build(r, c + h, k - 1),
+                    build(r + h, c, k - 1), build(r + h, c + h, k - 1))
+    return build(0, 0, k), 0, 0
+
+def to_grid(node, r0, c0, shape):
+    """
+    Converts the cells of the node in the window of the given shape, with top left cell at (0, 0),
+    into a grid of 0 and 1
+    """
+    grid = np.zeros(shape, dtype = np.uint8)
+
+    def fill(m, r, c):
+        size = 2**m.k
+        if m.population == 0 or r >= shape[0] or c >= shape[1] or r + size <= 0 or c + size <= 0:
+            return
+        if m.k == 0:
+            grid[r, c] = 1
+            return
+        h = size//2
+        fill(m.nw, r, c)
+        fill(m.ne, r, c + h)
+        fill(m.sw, r + h, c)
+        fill(m.se, r + h, c + h)
+    fill(node, r0, c0)
+    return grid
+
+# Engine used to evolve the grid: 'stencil' (one byte per cell), 'packed' (one bit per cell)
+# 'sparse' (only the cells near the changes are computed) or 'hashlife' (infinite plane,
+# only the cells inside the grid are shown)
+ENGINE = 'stencil'
+
+def generations(grid, engine = ENGINE, n_y = None):
+    """
+    Yields the grid in the successive generations, starting with the given one.
+    The packed engine yields the packed words of the grid, which may also be given
+    already packed (with n_y columns), so that the grid is never stored with a byte per cell.
+    The sparse engine yields the grid, which is modified in place in the next generation,
+    together with the indices of the tiles which changed (all of them at the start).
+    """
+    if engine == 'packed':
+        if grid.dtype == np.uint64:
+            if n_y is None or not 64*(grid.shape[1] - 1) < n_y <= 64*grid.shape[1]:
+                raise ValueError('A packed grid requires its number of columns n_y, consistent with its number of words')
+            words = grid
+        else:
+            n_y = grid.shape[1]
+            words = pack_grid(grid)
+        yield words
+        while True:
+            words = packed_step(words, n_y)
+            yield words
+
+    grid = grid.astype(np.uint8)
+    n_x, n_y = grid.shape
+    if engine == 'sparse':
+        active = np.ones((-(-n_x//TILE), -(-n_y//TILE)), dtype = bool)
+        yield grid, np.argwhere(active)
+        while True:
+            grid, active, changed = sparse_step(grid, active)
+            yield grid, changed
+
+    yield grid
+    if engine == 'hashlife':
+        node, r0, c0 = from_grid(grid)
+        while True:
+            node, r0, c0 = hashlife_advance(node, r0, c0, 1)
+            yield to_grid(node, r0, c0, (n_x, n_y))
+    else:
+        while True:
+            grid = life_step(grid)
+            yield grid
+
+# Longest period of the cycles searched in the history
+MAX_PERIOD = 30
+
+def compact_history(frames, iterations, max_period = MAX_PERIOD):
+    """
+    Stores up to iterations generations given by frames, bit-packed in 64-bit words as in pack_grid
+    (the frames of the packed engine are stored as they are), and stops when a generation repeats
+    one of the last max_period generations (the grid died, is still or oscillates).
+    The generations are compared by their hashes.
+    The frames of the sparse engine are stored as the indices and the packed contents
+    (see tile_codes) of the tiles which changed, and their hashes are updated tile by tile,
+    so that the cost of a generation does not grow with the size of the grid.
+    Returns the list of packed generations and the period of the cycle (0 if there is none).
+    """
+    history = []
+    keys = []
+    seen = {}
+    for i, frame in zip(range(iterations), frames):
+        if isinstance(frame, tuple):
+            grid, changed = frame
+            if i == 0:
+                hashes = np.zeros((-(-grid.shape[0]//TILE), -(-grid.shape[1]//TILE)), dtype = np.uint64)
+                key = 0
+            codes = tile_codes(grid, changed)
+            new_hashes = tile_hashes(codes, changed, hashes.shape[1])
+            key ^= int(np.bitwise_xor.reduce(hashes[changed[:, 0], changed[:, 1]] ^ new_hashes))
+            hashes[changed[:, 0], changed[:, 1]] = new_hashes
+            packed = (changed, codes)
+            j = seen.get(key)
+            if j is not None:
+                # The generation j is only rebuilt to confirm the cycle
+                for old_grid in history_grids(history[:j + 1], grid.shape):
+                    pass
+                if np.array_equal(old_grid, grid):
+                    return history, i - j
+        else:
+            packed = frame if frame.dtype == np.uint64 else pack_grid(frame)
+            key = hashlib.blake2b(np.ascontiguousarray(packed), digest_size = 16).digest()
+            j = seen.get(key)
+            if j is not None and np.array_equal(history[j], packed):
+                return history, i - j
+        history.append(packed)
+        keys.append(key)
+        seen[key] = i
+        if i >= max_period:
+            old = keys[i - max_period]
+            if seen.get(old) == i - max_period:
+                del seen[old]
+    return history, 0
+
+def history_grids(history, shape, tile = TILE):
+    """
+    Yields the grids of the successive generations stored in history by compact_history,
+    with shape (n_x, n_y). The tiles stored by the sparse engine are applied one generation after another.
+    """
+    grid = np.zeros(shape, dtype = np.uint8)
+    for packed in history:
+        if isinstance(packed, tuple):
+            changed, codes = packed
+            rows, cols, inside = _tile_cells(changed, tile, shape)
+            cells = np.unpackbits(codes, axis = 1, count = tile*tile).reshape(len(changed), tile, tile)
+            grid[rows[inside], cols[inside]] = cells[inside]
+            yield grid
+        else:
+            yield unpack_grid(packed, shape[1])
+
+# Iterate life
+iterations = 100
+if ENGINE == 'packed':
+    # Random initial configuration generated directly packed, valid for very large grids
+    frames = generations(random_words(N, N), n_y = N)
+else:
+    frames = generations(init_grid)
+history, period = compact_history(frames, iterations)
+if period > 0:
+    print('Cycle of period', period, 'reached at the generation', len(history) - period)
+
+if ENGINE == 'hashlife':
+    # Jump to a far generation
+    far = hashlife_advance(*from_grid(init_grid), 10**6)[0]
+    print('Population at the generation 10^6 =', far.population)
+
+# Animation, the generations are unpacked one by one while they are drawn
+def animate(frame, img, ax):
+    i, grid = frame
+    img.set_data(grid)
+    ax.set_title('i = '+str(i))
+    return img
+
+fig, ax = plt.subplots()
+img = ax.imshow(np.zeros((N, N)), interpolation = 'nearest',
+                vmin = 0, vmax = 1)
+ani = animation.FuncAnimation(fig, animate, fargs = (img, ax, ),
+                              frames = enumerate(history_grids(history, (N, N))), interval = 100,
+                              save_count = len(history), repeat = False)
+
+plt.show()
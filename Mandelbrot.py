@@ -1,40 +1,154 @@
-"""
-@author: HuidobroMG
-
-We construct and represent the Mandelbrot set, which is the first example of fractal structure.
-"""
-
-# Import the modules
-import numpy as np
-import matplotlib.pyplot as plt
-
-# Number of points and iterations
-N_points = int(1e3)
-N_iters = int(5e2)
-
-# Generate the grid and the limits
-x = np.linspace(-2, 1, N_points)
-y = np.linspace(-1.5, 1.5, N_points)
-Mset = np.zeros((N_points, N_points))
-
-# Construct the fractal
-for i in range(N_points):
-    for k in range(N_points):
-        c = complex(x[i], y[k])
-        z = 0 + 0j
-        for u in range(N_iters):
-            z = z*z + c
-            if abs(z) >= 2:
-                Mset[i, k] = N_iters - u
-                break
-
-# Plot using imshow()
-x, y = np.meshgrid(x, y)
-
-fig = plt.figure(figsize = (8, 8))
-fig.subplots_adjust(left = 0.05, right = 0.95, bottom = 0.05, top = 0.95)
-ax = fig.add_subplot(111)
-
-ax.imshow(Mset, cmap = 'seismic', extent=[-2, 1, -1.5, 1.5])
-
-plt.show()
+"""
+@author: HuidobroMG
+
+We construct and represent the Mandelbrot set, which is the first example of fractal structure.
+Large images are rendered in tiles by several processes, starting with a coarse preview
+which is refined until every point is computed.
+"""
+
+# Import the modules
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Number of points and iterations
+N_points = int(1e3)
+N_iters = int(5e2)
+
+# Escape time of a set of points, iterating only the points which have not escaped yet
+def escape_counts(c, N_iters, smooth = False):
+    """
+    Iterates z = z*z + c for the points c and returns N_iters - u, where u is the iteration
+    in which |z| >= 2, or 0 for the points which never escape.
+    If smooth is True, u is replaced by the fractional count u + 1 - log2(log|z|).
+    """
+    counts = np.zeros(c.shape, dtype = c.real.dtype)
+    z = np.zeros_like(c)
+    index = np.arange(c.size)
+    for u in range(N_iters):
+        z = z*z + c
+        escaped = z.real**2 + z.imag**2 >= 4
+        if np.any(escaped):
+            if smooth:
+                nu = u + 1 - np.log2(np.log(np.abs(z[escaped])))
+                counts[index[escaped]] = N_iters - nu
+            else:
+                counts[index[escaped]] = N_iters - u
+            active = ~escaped
+            z, c, index = z[active], c[active], index[active]
+            if index.size == 0:
+                break
+    return counts
+
+def escape_time(x, y, N_iters, smooth = False, dtype = np.float64, tile = 256):
+    """
+    Computes the escape counts Mset[i, k] of the points x[i] + iy[k], in tiles of tile x tile points,
+    with real numbers of the type dtype (np.float32 or np.float64)
+    """
+    complex_type = np.result_type(dtype, np.complex64)
+    x = np.asarray(x, dtype = dtype)
+    y = np.asarray(y, dtype = dtype)
+    Mset = np.zeros((len(x), len(y)), dtype = dtype)
+    for i in range(0, len(x), tile):
+        for k in range(0, len(y), tile):
+            c = (x[i:i+tile, None] + 1j*y[None, k:k+tile]).astype(complex_type)
+            Mset[i:i+tile, k:k+tile] = escape_counts(c.ravel(), N_iters, smooth).reshape(c.shape)
+    return Mset
+
+# Parallel rendering, with the image in shared memory
+_worker = {}
+
+def _init_worker(name, x, y, N_iters, smooth, dtype):
+    """
+    Attaches each process of the pool to the shared image
+    """
+    block = shared_memory.SharedMemory(name = name)
+    _worker.update({'block': block, 'x': x, 'y': y, 'N_iters': N_iters, 'smooth': smooth,
+                    'Mset': np.ndarray((len(x), len(y)), dtype = np.float32, buffer = block.buf),
+                    'complex_type': np.result_type(dtype, np.complex64)})
+
+def _tile_job(args):
+    """
+    Computes the points of a tile in the rows and columns multiple of step, skipping those
+    already computed with step 2*step if refine is True, and fills the step x step square
+    below and to the right of each point with its value
+    """
+    i0, i1, k0, k1, step, refine = args
+    x, y, Mset = _worker['x'], _worker['y'], _worker['Mset']
+    rows = np.arange(i0, i1, step)
+    cols = np.arange(k0, k1, step)
+    new = np.ones((len(rows), len(cols)), dtype = bool)
+    if refine:
+        new &= ~((rows % (2*step) == 0)[:, None] & (cols % (2*step) == 0)[None, :])
+    c = (x[rows, None] + 1j*y[None, cols]).astype(_worker['complex_type'])
+    values = np.zeros(c.shape, dtype = np.float32)
+    values[new] = escape_counts(c[new], _worker['N_iters'], _worker['smooth'])
+
+    values = np.repeat(np.repeat(values, step, axis = 0), step, axis = 1)[:i1-i0, :k1-k0]
+    new = np.repeat(np.repeat(new, step, axis = 0), step, axis = 1)[:i1-i0, :k1-k0]
+    Mset[i0:i1, k0:k1][new] = values[new]
+
+def render(x, y, N_iters, smooth = False, dtype = np.float64, tile = 256, coarse = 16,
+           n_workers = None, preview = None):
+    """
+    Computes the escape counts Mset[i, k] of the points x[i] + iy[k] (as escape_time) with
+    a pool of n_workers processes, each one computing tiles of tile x tile points of the
+    shared image. The image is first computed every coarse points, and then refined halving
+    the step until all the points are computed. The function preview(Mset) is called after
+    each level of refinement.
+    """
+    x = np.asarray(x, dtype = dtype)
+    y = np.asarray(y, dtype = dtype)
+    tile = max(coarse, tile - tile % coarse)
+    block = shared_memory.SharedMemory(create = True, size = max(4*len(x)*len(y), 4))
+    Mset = np.ndarray((len(x), len(y)), dtype = np.float32, buffer = block.buf)
+    Mset[:] = 0
+    try:
+        with mp.Pool(n_workers, initializer = _init_worker,
+                     initargs = (block.name, x, y, N_iters, smooth, dtype)) as pool:
+            step = coarse
+            while step >= 1:
+                jobs = [(i, min(i + tile, len(x)), k, min(k + tile, len(y)), step, step < coarse)
+                        for i in range(0, len(x), tile) for k in range(0, len(y), tile)]
+                pool.map(_tile_job, jobs)
+                if preview is not None:
+                    preview(Mset)
+                step //= 2
+        result = Mset.copy()
+    finally:
+        del Mset
+        block.close()
+        block.unlink()
+    return result
+
+if __name__ == '__main__':
+    # Generate the grid and the limits
+    x = np.linspace(-2, 1, N_points)
+    y = np.linspace(-1.5, 1.5, N_points)
+
+    fig = plt.figure(figsize = (8, 8))
+    fig.subplots_adjust(left = 0.05, right = 0.95, bottom = 0.05, top = 0.95)
+    ax = fig.add_subplot(111)
+
+    # Construct the fractal with several processes, showing the refinements (PARALLEL = 1),
+    # or in this process (PARALLEL = 0)
+    PARALLEL = 1
+    if PARALLEL == 1:
+        img = ax.imshow(np.zeros((N_points, N_points)), cmap = 'seismic', extent=[-2, 1, -1.5, 1.5],
+                        vmin = 0, vmax = N_iters)
+
+        def preview(Mset):
+            img.set_data(Mset)
+            plt.pause(0.01)
+
+        Mset = render(x, y, N_iters, preview = preview)
+        img.set_data(Mset)
+        img.set_clim(np.min(Mset), np.max(Mset))
+    else:
+        Mset = escape_time(x, y, N_iters)
+
+        # Plot using imshow()
+        ax.imshow(Mset, cmap = 'seismic', extent=[-2, 1, -1.5, 1.5])
+
+    plt.show()